@@ -0,0 +1,229 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import json
+import os
+import re
+import sys
+import threading
+from collections import deque
+from random import random
+from time import gmtime, strftime, time
+
+FORMATS = ("common", "combined", "json")
+
+# Written as \xNN, like Apache does, so a header holding a line
+# break cannot forge log lines
+CONTROL_CHARS = re.compile(r"[\x00-\x1f\x7f]")
+
+# Access log whose hot path is one deque append: deque.append and
+# popleft are atomic, so request handlers never take a lock and
+# all formatting and file I/O happens on the writer thread
+class AccessLog:
+
+    def __init__(self, path, log_format="combined", max_bytes=0, backups=5,
+        max_queue=65536, batch_size=1024, flush_interval=0.2, sample_2xx=1.0):
+        if log_format not in FORMATS:
+            raise ValueError(f"unknown access log format: {log_format}")
+
+        # "-" writes to stdout, which is never rotated
+        self.path = path
+        self.log_format = log_format
+        # Rotate once the file would grow past max_bytes,
+        # keeping path.1 .. path.<backups>; 0 never rotates
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Fraction of 2xx responses that are logged; errors and
+        # redirects are always kept
+        self.sample_2xx = sample_2xx
+
+        self.records = deque()
+        # Records refused because the queue was full. Updated
+        # without a lock, so it may undercount under contention
+        self.dropped = 0
+        self.written = 0
+
+        self.write_lock = threading.Lock()
+        self.file = None
+        self.open()
+
+        self.stop = threading.Event()
+        self.writer = None
+        self.start_writer()
+
+        # Forked workers get an empty queue and a writer of their
+        # own; threads do not survive fork
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def log(self, peer, summary, body_bytes, latency_ns):
+        # summary is the (method, path, version, status, user agent,
+        # referer) tuple returned by HttpResponder.process_request
+        if summary[3] < 300 and self.sample_2xx < 1.0 and random() >= self.sample_2xx:
+            return
+
+        if len(self.records) >= self.max_queue:
+            self.dropped += 1
+            return
+
+        self.records.append((time(), peer, summary, body_bytes, latency_ns))
+
+    def start_writer(self):
+        self.writer = threading.Thread(target=self.run, daemon=True)
+        self.writer.start()
+
+    def after_fork(self):
+        self.records = deque()
+        self.write_lock = threading.Lock()
+        self.stop = threading.Event()
+        self.start_writer()
+
+    def run(self):
+        while not self.stop.wait(self.flush_interval):
+            self.flush()
+
+        self.flush()
+
+    def flush(self):
+        # Also called directly by processes that are about to exit
+        with self.write_lock:
+            while self.records:
+                batch = []
+                while self.records and len(batch) < self.batch_size:
+                    batch.append(self.format(*self.records.popleft()))
+
+                self.write("".join(batch))
+                self.written += len(batch)
+
+    def close(self):
+        self.stop.set()
+        if self.writer is not None:
+            self.writer.join()
+
+        if self.file is not sys.stdout:
+            self.file.close()
+
+    def open(self):
+        if self.path == "-":
+            self.file = sys.stdout
+            return
+
+        # Append mode keeps whole lines intact when several
+        # processes share the file
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, data):
+        if self.max_bytes and self.file is not sys.stdout:
+            # Worker processes append to the same file, so its size
+            # is read from the file rather than counted here
+            self.follow_rotation()
+            if os.fstat(self.file.fileno()).st_size + len(data) > self.max_bytes:
+                self.rotate_shared()
+
+        self.file.write(data)
+        self.file.flush()
+
+    def follow_rotation(self):
+        # Reopens path if another process rotated it away from
+        # under this one. True when it did
+        try:
+            current = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            current = None
+
+        if current == os.fstat(self.file.fileno()).st_ino:
+            return False
+
+        self.file.close()
+        self.open()
+        return True
+
+    def rotate_shared(self):
+        # Workers forked from one process share self.file's open
+        # file description, and with it any flock on it, so the
+        # lock is taken through a descriptor of this call's own
+        try:
+            lock_fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            self.follow_rotation()
+            return
+
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            # The process holding the lock before may have rotated
+            if not self.follow_rotation() and os.fstat(self.file.fileno()).st_size > 0:
+                self.rotate()
+        finally:
+            os.close(lock_fd)
+
+    def rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+        self.open()
+
+    def format(self, timestamp, peer, summary, body_bytes, latency_ns):
+        method, path, version, status, agent, referer = summary
+        if self.log_format == "json":
+            return json.dumps({
+                "time": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(timestamp)),
+                "peer": peer,
+                "method": method,
+                "path": path,
+                "version": version,
+                "status": status,
+                "bytes": body_bytes,
+                "latency_ms": round(latency_ns / 1e6, 3),
+                "user_agent": agent,
+                "referer": referer,
+            }) + "\n"
+
+        if method is None:
+            request = "-"
+        else:
+            request = f"{method} {path} {version}"
+
+        line = (
+            f'{peer} - - [{strftime("%d/%b/%Y:%H:%M:%S +0000", gmtime(timestamp))}] '
+            f'"{self.escape(request)}" {status} {body_bytes or "-"}'
+        )
+        if self.log_format == "combined":
+            line += f' "{self.escape(referer)}" "{self.escape(agent)}"'
+
+        return line + "\n"
+
+    def escape(self, value):
+        if value is None:
+            return "-"
+
+        value = value.replace("\\", "\\\\").replace('"', '\\"')
+        return CONTROL_CHARS.sub(lambda match: f"\\x{ord(match.group()):02x}", value)
+
+    def stats(self):
+        return {
+            "queued": len(self.records),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
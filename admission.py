@@ -0,0 +1,154 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from collections import OrderedDict
+from math import ceil
+from time import monotonic
+
+# Decides which connections and requests are served. Every check
+# is a few dict operations under one lock; per-client tables are
+# kept in least recently used order so idle clients are expired
+# from the front without scanning. Each process keeps its own
+# tables, so with --mode prefork the limits apply per worker. They
+# are refused with --mode fork, where every connection gets a fresh
+# child whose copy of the tables no other connection ever updates
+class Admission:
+
+    def __init__(self, max_connections=0, max_connections_per_ip=0,
+        rate=0.0, burst=None, max_inflight=0, shed_latency=0.0,
+        retry_after=1, idle_expiry=60.0):
+        # A limit of 0 disables that check
+        self.max_connections = max_connections
+        self.max_connections_per_ip = max_connections_per_ip
+        # Token bucket per client IP: rate requests per second,
+        # up to burst requests at once
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        # Requests being processed at once, across all connections
+        self.max_inflight = max_inflight
+        # Seconds; shed while the average latency is above it
+        self.shed_latency = shed_latency
+        self.retry_after = retry_after
+        self.idle_expiry = idle_expiry
+
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.ip_connections = {}
+        # ip -> [tokens, last refill]; oldest first
+        self.buckets = OrderedDict()
+        self.inflight = 0
+        # Moving average of request latency and when it was last
+        # updated. Shed requests add no samples, so an average
+        # older than a second no longer triggers shedding and
+        # the next request measures the server again
+        self.latency = 0.0
+        self.latency_updated = 0.0
+
+    def connection_opened(self, ip):
+        with self.lock:
+            if self.max_connections and self.connections >= self.max_connections:
+                return False
+
+            count = self.ip_connections.get(ip, 0)
+            if self.max_connections_per_ip and count >= self.max_connections_per_ip:
+                return False
+
+            self.connections += 1
+            self.ip_connections[ip] = count + 1
+            return True
+
+    def connection_closed(self, ip):
+        with self.lock:
+            self.connections -= 1
+            count = self.ip_connections[ip] - 1
+            # Entries only exist for open connections
+            if count:
+                self.ip_connections[ip] = count
+            else:
+                del self.ip_connections[ip]
+
+    def check_request(self, ip):
+        # Returns None to serve the request, or the (status code,
+        # Retry-After seconds) to answer with instead
+        now = monotonic()
+        with self.lock:
+            if self.is_overloaded(now):
+                return 503, self.retry_after
+
+            if self.rate:
+                wait = self.take_token(ip, now)
+                if wait:
+                    return 429, ceil(wait)
+
+            self.inflight += 1
+            return None
+
+    def request_finished(self, latency):
+        now = monotonic()
+        with self.lock:
+            self.inflight -= 1
+            if now - self.latency_updated > 1.0:
+                self.latency = latency
+            else:
+                self.latency += (latency - self.latency) * 0.1
+            self.latency_updated = now
+
+    def is_overloaded(self, now):
+        if self.max_inflight and self.inflight >= self.max_inflight:
+            return True
+
+        return (
+            self.shed_latency > 0
+            and self.latency > self.shed_latency
+            and now - self.latency_updated <= 1.0
+        )
+
+    def take_token(self, ip, now):
+        # Returns 0 when a token was taken, otherwise the seconds
+        # until the next one is available
+        bucket = self.buckets.get(ip)
+        if bucket is None:
+            bucket = self.buckets[ip] = [self.burst, now]
+        else:
+            self.buckets.move_to_end(ip)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        self.expire(now)
+
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return 0
+
+        return (1.0 - bucket[0]) / self.rate
+
+    def expire(self, now):
+        # An idle client's bucket is full again, so forgetting it
+        # changes nothing. At most a couple of entries go per call
+        for _ in range(2):
+            ip, bucket = next(iter(self.buckets.items()))
+            if now - bucket[1] < self.idle_expiry:
+                break
+
+            del self.buckets[ip]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "connections": self.connections,
+                "clients": len(self.ip_connections),
+                "buckets": len(self.buckets),
+                "inflight": self.inflight,
+            }
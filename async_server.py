@@ -0,0 +1,297 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import signal
+from handoff import notify_ready, spawn_successor
+from http_req_parser import *
+from http2 import Http2Connection
+from http_responder import HttpResponder
+from mmap_store import SEND_DIRECT_BYTES
+from resource_locator import FileBody
+from server_modes import create_listener, run_reload_hooks
+from streaming import LAST_CHUNK, StreamingResponse, iterate_async
+from time import perf_counter_ns
+
+# Event-loop engine: every connection is a coroutine on one
+# thread, so idle keep-alive clients only cost a socket and a
+# small buffer instead of a blocked thread or process
+class AsyncWebServer(HttpResponder):
+
+    def __init__(self):
+        self.draining = False
+        self.connections = set()
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        if self.metrics is not None:
+            self.metrics.connection_opened()
+
+        requests_served = 0
+        keep_alive = True
+
+        peer = writer.get_extra_info("peername")
+        ip = peer[0] if peer else "-"
+        admitted = False
+        ssl_object = writer.get_extra_info("ssl_object")
+        tls = ssl_object is not None
+
+        try:
+            if self.admission is not None:
+                if not self.admission.connection_opened(ip):
+                    head, body, _, summary = self.process_rejection(
+                        503,
+                        self.admission.retry_after
+                    )
+                    await self.send_response(writer, head, body)
+                    self.log_access(writer, summary, 0, 0)
+                    return
+
+                admitted = True
+
+            if tls and ssl_object.selected_alpn_protocol() == "h2":
+                await Http2Connection(self, reader, writer).serve()
+                return
+
+            while keep_alive:
+                try:
+                    raw_req = await self.read_request(reader)
+                except HTTPReqParserException as e:
+                    # Request too large or too slow, answer and hang up
+                    head, body, keep_alive, summary = self.process_error(e)
+                    sent = await self.send_response(writer, head, body)
+                    self.log_access(writer, summary, sent - len(head), 0)
+                    break
+
+                if raw_req is None:
+                    # Peer closed the connection or stayed idle
+                    break
+
+                requests_served += 1
+                keep_alive = (
+                    requests_served < self.max_keep_alive_requests
+                    and not self.draining
+                )
+                if self.admission is not None:
+                    rejection = self.admission.check_request(ip)
+                    if rejection is not None:
+                        code, retry_after = rejection
+                        head, body, keep_alive, summary = self.process_rejection(
+                            code,
+                            retry_after,
+                            keep_alive and code == 429
+                        )
+                        await self.send_response(writer, head, body)
+                        self.log_access(writer, summary, 0, 0)
+                        continue
+
+                # Only the synchronous part is profiled; other
+                # connections run while this one awaits its send
+                profile = None
+                if self.profiler is not None:
+                    profile = self.profiler.start_sample()
+
+                start = perf_counter_ns()
+                try:
+                    try:
+                        head, body, keep_alive, summary = self.process_request(
+                            raw_req,
+                            keep_alive,
+                            tls
+                        )
+                    finally:
+                        if profile is not None:
+                            self.profiler.finish_sample(profile)
+
+                    # Other connections overwrite it during the send
+                    marks = self.marks if self.profiler is not None else None
+                    sending = perf_counter_ns()
+                    sent = await self.send_response(writer, head, body)
+                finally:
+                    if self.admission is not None:
+                        self.admission.request_finished((perf_counter_ns() - start) / 1e9)
+
+                if self.metrics is not None:
+                    self.metrics.observe_send(start, sending, sent)
+                if marks is not None:
+                    self.profiler.observe(summary, start, *marks, sending, perf_counter_ns())
+
+                self.log_access(writer, summary, sent - len(head), perf_counter_ns() - start)
+
+        except ConnectionError:
+            pass
+
+        finally:
+            self.connections.discard(task)
+            if admitted:
+                self.admission.connection_closed(ip)
+            if self.metrics is not None:
+                self.metrics.connection_closed()
+
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def log_access(self, writer, summary, body_bytes, latency_ns):
+        if self.access_log is not None:
+            peer = writer.get_extra_info("peername")
+            self.access_log.log(peer[0] if peer else "-", summary, body_bytes, latency_ns)
+
+    async def read_request(self, reader):
+        # The first byte is awaited on its own so an idle keep-alive
+        # connection and a client stalling mid-request get
+        # different timeouts
+        try:
+            first = await asyncio.wait_for(
+                reader.readexactly(1),
+                self.keep_alive_timeout
+            )
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return None
+
+        try:
+            rest = await asyncio.wait_for(
+                reader.readuntil(b"\r\n\r\n"),
+                self.request_timeout
+            )
+        except asyncio.TimeoutError:
+            raise RequestTimeout
+        except asyncio.LimitOverrunError:
+            raise RequestHeaderFieldsTooLarge
+        except asyncio.IncompleteReadError:
+            return None
+
+        return first + rest
+
+    async def send_response(self, writer, head, body):
+        if isinstance(body, StreamingResponse):
+            return await self.send_stream(writer, head, body)
+
+        parts = body if isinstance(body, list) else [body]
+        sent = len(head)
+
+        pending = head
+        for part in parts:
+            sent += len(part)
+            if isinstance(part, FileBody):
+                writer.write(pending)
+                await writer.drain()
+                pending = b""
+                # Uses os.sendfile on the transport's socket when the
+                # loop supports it, otherwise falls back to chunked reads
+                with open(part.path, "rb") as file_descr:
+                    await asyncio.get_running_loop().sendfile(
+                        writer.transport,
+                        file_descr,
+                        part.offset,
+                        part.count
+                    )
+
+            elif isinstance(part, memoryview) and len(part) >= SEND_DIRECT_BYTES:
+                writer.write(pending)
+                pending = b""
+                writer.write(part)
+                await writer.drain()
+
+            else:
+                pending += part
+
+        if pending:
+            writer.write(pending)
+            await writer.drain()
+
+        return sent
+
+    async def send_stream(self, writer, head, body):
+        writer.write(head)
+        await writer.drain()
+        sent = len(head)
+        async for chunk in iterate_async(body.chunks):
+            if chunk:
+                frame = body.frame(chunk)
+                writer.write(frame)
+                sent += len(frame)
+                # Waits while the transport buffer is above its
+                # high-water mark, pausing the producer
+                await writer.drain()
+
+        if body.chunked:
+            writer.write(LAST_CHUNK)
+            await writer.drain()
+            sent += len(LAST_CHUNK)
+
+        return sent
+
+    async def serve(self, listeners, backlog=128, options=None):
+        # listeners are (address, ssl.SSLContext or None) pairs
+        servers = []
+        socks = []
+        for address, tls_context in listeners:
+            socks.append(create_listener(address, backlog, options))
+            servers.append(await asyncio.start_server(
+                self.handle,
+                sock=socks[-1],
+                # readuntil gives up once a head outgrows the buffer
+                limit=self.max_header_size,
+                ssl=tls_context,
+                ssl_handshake_timeout=self.request_timeout if tls_context else None
+            ))
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        async def restart():
+            # Drains only once the successor is serving
+            if await loop.run_in_executor(None, spawn_successor, socks):
+                stop.set()
+
+        loop.add_signal_handler(
+            signal.SIGHUP,
+            lambda: loop.run_in_executor(None, run_reload_hooks)
+        )
+        loop.add_signal_handler(
+            signal.SIGUSR2,
+            lambda: asyncio.create_task(restart())
+        )
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+        notify_ready()
+
+        try:
+            await stop.wait()
+
+            # Stop accepting, then give in-flight requests one
+            # keep-alive period to finish before cancelling them
+            for server in servers:
+                server.close()
+            self.draining = True
+            pending = list(self.connections)
+            if pending:
+                _, still_open = await asyncio.wait(
+                    pending,
+                    timeout=self.keep_alive_timeout
+                )
+                for task in still_open:
+                    task.cancel()
+
+        finally:
+            for server in servers:
+                server.close()
+                await server.wait_closed()
+
+def serve_async(listeners, backlog=128, options=None):
+    asyncio.run(AsyncWebServer().serve(listeners, backlog, options))
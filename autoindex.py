@@ -0,0 +1,317 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import os
+from file_cache import LruCache
+from html import escape
+from os.path import isdir, isfile, join
+from resource_locator import ResourceLocator
+from streaming import StreamingResponse
+from time import gmtime, monotonic, strftime
+from urllib.parse import parse_qs, quote, unquote
+
+# Fields of a listing entry
+NAME, IS_DIR, SIZE, MTIME, INODE = range(5)
+
+SORT_KEYS = {
+    "name": lambda entry: entry[NAME],
+    "size": lambda entry: (entry[SIZE], entry[NAME]),
+    "mtime": lambda entry: (entry[MTIME], entry[NAME]),
+}
+
+# Rows rendered per chunk written to the client
+ROWS_PER_CHUNK = 200
+
+class Listing:
+    __slots__ = ("mtime_ns", "entries", "orders", "checked")
+
+    def __init__(self, mtime_ns, entries):
+        self.mtime_ns = mtime_ns
+        # name -> (name, is_dir, size, mtime_ns, inode)
+        self.entries = entries
+        # (sort key, descending) -> entries in that order, built
+        # on first use
+        self.orders = {}
+        # monotonic() time of the last stat() against the directory
+        self.checked = monotonic()
+
+    def sorted(self, sort, descending=False):
+        order = self.orders.get((sort, descending))
+        if order is None:
+            # Directories come first in either direction
+            key = SORT_KEYS[sort]
+            if descending:
+                order = sorted(
+                    self.entries.values(),
+                    key=lambda entry: (entry[IS_DIR], key(entry)),
+                    reverse=True
+                )
+            else:
+                order = sorted(
+                    self.entries.values(),
+                    key=lambda entry: (not entry[IS_DIR], key(entry))
+                )
+            self.orders[(sort, descending)] = order
+
+        return order
+
+# Directory listings for directories without an index file. Each
+# directory's scan is cached until its mtime changes, which happens
+# whenever an entry is added, removed or renamed. A rescan reuses
+# the stat() results of entries whose inode is unchanged, so adding
+# one file to a directory of 50000 costs one stat(). Files rewritten
+# in place keep their old size and date until the directory changes
+class Autoindex:
+
+    def __init__(self, page_size=1000, max_dirs=256, revalidate_interval=1.0,
+        scan_in_executor=False):
+        self.page_size = page_size
+        self.max_dirs = max_dirs
+        # Listings checked less than this many seconds ago are
+        # served without a stat() of the directory
+        self.revalidate_interval = revalidate_interval
+        # Set for the asyncio engine: listings that need a stat()
+        # or a scan are built on the loop's default executor while
+        # the body is sent, so a large directory does not stall
+        # every other connection
+        self.scan_in_executor = scan_in_executor
+
+        # Directory path -> Listing, bounded by count rather than
+        # bytes: every listing costs 1
+        self.listings = LruCache(max_dirs, lambda listing: 1)
+
+    def respond(self, path, root, index=None):
+        # A StreamingResponse listing the directory path names, or
+        # None when it is not a directory without an index file
+        url_path, _, query = path.partition("?")
+        if not url_path.endswith("/"):
+            return None
+
+        dir_path = self.find_directory(url_path, root, index)
+        if dir_path is None:
+            return None
+
+        params = parse_qs(query)
+        sort = params.get("sort", ["name"])[0]
+        if sort not in SORT_KEYS:
+            sort = "name"
+        descending = params.get("order", ["asc"])[0] == "desc"
+        try:
+            page = max(1, int(params.get("page", ["1"])[0]))
+        except ValueError:
+            page = 1
+
+        if params.get("format", ["html"])[0] == "json":
+            render, content_type = self.render_json, "application/json"
+        else:
+            render, content_type = self.render_html, "text/html; charset=utf-8"
+
+        view = (url_path, sort, descending, page)
+        listing = self.get_fresh(dir_path)
+        if listing is None and self.scan_in_executor:
+            return StreamingResponse(self.render_later(dir_path, render, view), content_type)
+
+        if listing is None:
+            listing = self.revalidate(dir_path)
+            if listing is None:
+                return None
+
+        return StreamingResponse(render(*self.paginate(listing, *view)), content_type)
+
+    async def render_later(self, dir_path, render, view):
+        loop = asyncio.get_running_loop()
+        listing = await loop.run_in_executor(None, self.revalidate, dir_path)
+        if listing is None:
+            # Removed after the head was sent
+            listing = Listing(0, {})
+
+        for chunk in render(*self.paginate(listing, *view)):
+            yield chunk
+
+    def paginate(self, listing, url_path, sort, descending, page):
+        # Arguments for render_html and render_json
+        entries = listing.sorted(sort, descending)
+        pages = max(1, -(-len(entries) // self.page_size))
+        page = min(page, pages)
+        start = (page - 1) * self.page_size
+        rows = entries[start:start + self.page_size]
+        return rows, url_path, sort, descending, page, pages, len(entries)
+
+    def find_directory(self, url_path, root, index):
+        if index is not None:
+            entry = index.lookup(url_path)
+            if entry is None or not entry.is_dir or entry.has_index:
+                return None
+
+            return entry.path
+
+        dir_path = join(root + unquote(url_path))
+        if not ResourceLocator.is_inside(dir_path, root) or not isdir(dir_path):
+            return None
+
+        # find() only misses an existing index file when the URL
+        # has a query string
+        if isfile(join(dir_path, ResourceLocator.index_f)):
+            return None
+
+        return dir_path
+
+    def get_fresh(self, dir_path):
+        # The listing if it was checked recently enough to be
+        # served without touching the disk, else None
+        listing = self.listings.get(dir_path)
+        if listing is None or monotonic() - listing.checked >= self.revalidate_interval:
+            return None
+
+        self.listings.hit()
+        return listing
+
+    def revalidate(self, dir_path):
+        # stat()s the directory and rescans it if it changed
+        listing = self.listings.get(dir_path)
+        now = monotonic()
+        try:
+            mtime_ns = os.stat(dir_path).st_mtime_ns
+            if listing is not None and listing.mtime_ns == mtime_ns:
+                listing.checked = now
+                self.listings.hit()
+                return listing
+
+            listing = Listing(mtime_ns, self.scan(dir_path, listing))
+
+        except OSError:
+            self.invalidate(dir_path)
+            return None
+
+        self.listings.miss()
+        self.listings.put(dir_path, listing)
+        return listing
+
+    def scan(self, dir_path, old=None):
+        old_entries = old.entries if old is not None else {}
+        entries = {}
+        with os.scandir(dir_path) as dirents:
+            for dirent in dirents:
+                name = dirent.name
+                if name.startswith("."):
+                    continue
+
+                # DirEntry.inode() comes from the directory itself,
+                # no stat() needed to spot a replaced file
+                previous = old_entries.get(name)
+                if previous is not None and previous[INODE] == dirent.inode():
+                    entries[name] = previous
+                    continue
+
+                try:
+                    stat = dirent.stat()
+                except OSError:
+                    # Dangling symlink or removed since listed
+                    continue
+
+                entries[name] = (
+                    name,
+                    dirent.is_dir(),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    dirent.inode()
+                )
+
+        return entries
+
+    def invalidate(self, dir_path):
+        self.listings.pop(dir_path)
+
+    def clear(self):
+        self.listings.clear()
+
+    def render_html(self, rows, url_path, sort, descending, page, pages, total):
+        title = escape(f"Index of {unquote(url_path)}")
+        links = []
+        for key, label in (("name", "Name"), ("size", "Size"), ("mtime", "Modified")):
+            # Clicking the current column flips its order
+            order = "desc" if key == sort and not descending else "asc"
+            links.append(f'<th><a href="?sort={key}&amp;order={order}">{label}</a></th>')
+
+        head = (
+            f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{title}</title>'
+            f'</head><body>\n<h1>{title}</h1>\n<p>{total} entries, page {page} of {pages}'
+            f'</p>\n<table>\n<tr>{"".join(links)}</tr>\n'
+        )
+        if url_path != "/":
+            head += '<tr><td><a href="../">../</a></td><td></td><td></td></tr>\n'
+        yield self.encode(head)
+
+        for offset in range(0, len(rows), ROWS_PER_CHUNK):
+            lines = []
+            for name, is_dir, size, mtime_ns, _ in rows[offset:offset + ROWS_PER_CHUNK]:
+                suffix = "/" if is_dir else ""
+                lines.append(
+                    f'<tr><td><a href="{quote(name, errors="surrogateescape")}{suffix}">'
+                    f'{escape(name)}{suffix}</a></td>'
+                    f'<td>{"-" if is_dir else size}</td>'
+                    f'<td>{self.format_time(mtime_ns)}</td></tr>\n'
+                )
+            yield self.encode("".join(lines))
+
+        order = "desc" if descending else "asc"
+        nav = []
+        if page > 1:
+            nav.append(f'<a href="?sort={sort}&amp;order={order}&amp;page={page - 1}">Previous</a>')
+        if page < pages:
+            nav.append(f'<a href="?sort={sort}&amp;order={order}&amp;page={page + 1}">Next</a>')
+        yield self.encode(f'</table>\n<p>{" ".join(nav)}</p>\n</body></html>\n')
+
+    def render_json(self, rows, url_path, sort, descending, page, pages, total):
+        head = json.dumps({
+            "path": unquote(url_path),
+            "sort": sort,
+            "order": "desc" if descending else "asc",
+            "page": page,
+            "pages": pages,
+            "total": total,
+        })
+        # The entries array is spliced in so it can be streamed
+        yield self.encode(head[:-1] + ', "entries": [')
+
+        for offset in range(0, len(rows), ROWS_PER_CHUNK):
+            items = [
+                json.dumps({
+                    "name": name,
+                    "type": "directory" if is_dir else "file",
+                    "size": None if is_dir else size,
+                    "mtime": self.format_time(mtime_ns, "%Y-%m-%dT%H:%M:%SZ"),
+                })
+                for name, is_dir, size, mtime_ns, _ in rows[offset:offset + ROWS_PER_CHUNK]
+            ]
+            separator = ", " if offset else ""
+            yield self.encode(separator + ", ".join(items))
+
+        yield b"]}\n"
+
+    def format_time(self, mtime_ns, time_format="%Y-%m-%d %H:%M"):
+        return strftime(time_format, gmtime(mtime_ns // 10**9))
+
+    def encode(self, text):
+        # Undecodable file names come back from scandir as
+        # surrogates; they cannot be valid UTF-8
+        return text.encode("utf-8", "replace")
+
+    def stats(self):
+        # The cost is a count of listings, not bytes
+        stats = self.listings.stats()
+        del stats["bytes"]
+        return stats
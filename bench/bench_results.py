@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Saves benchmark results as JSON tagged with the commit they
+# were measured on, and compares two such files
+#
+# run: python bench/bench_results.py old.json new.json [threshold]
+
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+# Metrics where a smaller number is the better one; everything
+# else (throughput, operations per second) should go up
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "p999_ms", "error_rate", "build_seconds")
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save(path, name, results, params=None):
+    document = {
+        "benchmark": name,
+        "commit": git_commit(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "params": params or {},
+        "results": results,
+    }
+    with open(path, "w") as file_descr:
+        json.dump(document, file_descr, indent=2, sort_keys=True)
+
+    print(f"saved {path}")
+
+def flatten(results, prefix=""):
+    # {"200": {"after": 1.0}} -> {"200.after": 1.0}
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+
+    return flat
+
+def compare(old_path, new_path, threshold=0.10):
+    # Prints every metric present in both files and returns the
+    # names of those that got worse by more than threshold
+    with open(old_path) as file_descr:
+        old = json.load(file_descr)
+    with open(new_path) as file_descr:
+        new = json.load(file_descr)
+
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    old_flat = flatten(old["results"])
+    new_flat = flatten(new["results"])
+
+    regressions = []
+    for key in sorted(old_flat.keys() & new_flat.keys()):
+        before, after = old_flat[key], new_flat[key]
+        if before == 0:
+            change = 0.0 if after == 0 else float("inf")
+        else:
+            change = (after - before) / before
+
+        worse = -change if not key.endswith(LOWER_IS_BETTER) else change
+        mark = ""
+        if worse > threshold:
+            mark = "  REGRESSION"
+            regressions.append(key)
+
+        print(f"{key:40} {before:14.4f} {after:14.4f} {change:+8.1%}{mark}")
+
+    return regressions
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("usage: bench_results.py old.json new.json [threshold]")
+
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 0.10
+    sys.exit(1 if compare(sys.argv[1], sys.argv[2], threshold) else 0)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Load generator for a running server. Every process drives one
+# connection over raw sockets and records the latency of each
+# request, so the client adds no HTTP library overhead
+#
+# run: python server.py --mode thread &
+#      python bench/load_gen.py [--processes 8] [--duration 5]
+#          [--no-keep-alive] [--scenario small] [--output load.json]
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+from time import perf_counter, perf_counter_ns
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_results import save
+
+WWW = os.path.join(os.path.dirname(__file__), "..", "www")
+
+LARGE_FILE = "bench_large.bin"
+LARGE_SIZE = 4 * 1024 * 1024
+
+# name -> (request line, expected status)
+SCENARIOS = {
+    "small": (b"GET /base.css HTTP/1.1", 200),
+    "large": (b"GET /" + LARGE_FILE.encode() + b" HTTP/1.1", 200),
+    "404": (b"GET /missing.html HTTP/1.1", 404),
+    # The server answers and then closes the connection
+    "malformed": (b"GET /base.css HTTP/9.9 junk", None),
+}
+
+# Status codes a malformed request may legitimately get
+MALFORMED_CODES = (400, 505)
+
+def build_request(request_line, host, keep_alive):
+    connection = b"keep-alive" if keep_alive else b"close"
+    return (
+        request_line + b"\r\n"
+        b"Host: " + host.encode() + b"\r\n"
+        b"Accept: */*\r\n"
+        b"Connection: " + connection + b"\r\n"
+        b"\r\n"
+    )
+
+class ResponseReader:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.scratch = bytearray(256 * 1024)
+
+    def read_response(self):
+        # Returns (status, close); bodies are read and discarded
+        while True:
+            end = self.buffer.find(b"\r\n\r\n")
+            if end >= 0:
+                break
+
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError("closed before the response head")
+            self.buffer += data
+
+        head = bytes(self.buffer[:end])
+        del self.buffer[:end + 4]
+
+        lines = head.split(b"\r\n")
+        status = int(lines[0].split(b" ", 2)[1])
+        length = None
+        close = False
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"connection":
+                close = value.strip().lower() == b"close"
+
+        if length is None:
+            # No length: the body runs until the server closes
+            self.drain()
+            return status, True
+
+        buffered = min(length, len(self.buffer))
+        del self.buffer[:buffered]
+        remaining = length - buffered
+        view = memoryview(self.scratch)
+        while remaining > 0:
+            received = self.sock.recv_into(view, min(remaining, len(self.scratch)))
+            if not received:
+                raise ConnectionError("closed mid-body")
+            remaining -= received
+
+        return status, close
+
+    def drain(self):
+        self.buffer.clear()
+        while self.sock.recv_into(self.scratch):
+            pass
+
+def expected_status(scenario, status):
+    expected = SCENARIOS[scenario][1]
+    if expected is None:
+        return status in MALFORMED_CODES
+
+    return status == expected
+
+def worker(address, scenario, keep_alive, duration, timeout, results):
+    request = build_request(SCENARIOS[scenario][0], f"{address[0]}:{address[1]}", keep_alive)
+    latencies = []
+    errors = 0
+    sock = None
+    reader = None
+
+    deadline = perf_counter() + duration
+    while perf_counter() < deadline:
+        # Latency includes connecting whenever a new
+        # connection is needed
+        start = perf_counter_ns()
+        try:
+            if sock is None:
+                sock = socket.create_connection(address, timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                reader = ResponseReader(sock)
+
+            sock.sendall(request)
+            status, close = reader.read_response()
+            latencies.append(perf_counter_ns() - start)
+            if not expected_status(scenario, status):
+                errors += 1
+
+        except (OSError, ValueError, IndexError):
+            errors += 1
+            close = True
+
+        if close or not keep_alive:
+            if sock is not None:
+                sock.close()
+            sock = None
+
+    if sock is not None:
+        sock.close()
+
+    results.put((latencies, errors))
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index] / 1e6
+
+def run_scenario(address, scenario, processes, duration, keep_alive, timeout):
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=worker,
+            args=(address, scenario, keep_alive, duration, timeout, results)
+        )
+        for _ in range(processes)
+    ]
+
+    start = perf_counter()
+    for process in workers:
+        process.start()
+
+    # Read before joining: a child cannot exit while its large
+    # result is still stuck in the queue's pipe
+    latencies = []
+    errors = 0
+    for _ in workers:
+        worker_latencies, worker_errors = results.get()
+        latencies += worker_latencies
+        errors += worker_errors
+
+    for process in workers:
+        process.join()
+    elapsed = perf_counter() - start
+
+    latencies.sort()
+    attempts = len(latencies) + errors
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "error_rate": errors / attempts if attempts else 0.0,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50),
+        "p99_ms": percentile(latencies, 0.99),
+        "p999_ms": percentile(latencies, 0.999),
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test a running server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count() or 4,
+        help="client processes, each with its own connection"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=5.0,
+        help="seconds each scenario runs"
+    )
+    parser.add_argument(
+        "--no-keep-alive",
+        action="store_true",
+        help="open a new connection for every request"
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=list(SCENARIOS),
+        help="scenarios to run, all of them by default"
+    )
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    address = (args.host, args.port)
+    keep_alive = not args.no_keep_alive
+    scenarios = args.scenario or list(SCENARIOS)
+
+    # The large file is created in www for the duration of the
+    # run, the same way the functional tests create their files
+    large_path = os.path.join(WWW, LARGE_FILE)
+    created = False
+    if "large" in scenarios and not os.path.exists(large_path):
+        with open(large_path, "wb") as file_descr:
+            file_descr.write(os.urandom(LARGE_SIZE))
+        created = True
+
+    results = {}
+    try:
+        for scenario in scenarios:
+            result = run_scenario(
+                address,
+                scenario,
+                args.processes,
+                args.duration,
+                keep_alive,
+                args.timeout
+            )
+            results[scenario] = result
+            print(
+                f"{scenario:10} {result['throughput']:10,.0f} req/s   "
+                f"p50 {result['p50_ms']:7.3f}ms   p99 {result['p99_ms']:7.3f}ms   "
+                f"p999 {result['p999_ms']:7.3f}ms   errors {result['error_rate']:.2%}"
+            )
+
+    finally:
+        if created:
+            os.remove(large_path)
+
+    if args.output:
+        save(args.output, "load_gen", results, {
+            "processes": args.processes,
+            "duration": args.duration,
+            "keep_alive": keep_alive,
+        })
+
+if __name__ == "__main__":
+    main()
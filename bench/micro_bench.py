@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Operations per second of HttpReqParser.parse and
+# ResourceLocator.find on the shipped ./www tree. Save the
+# results of two commits and compare them with bench_results.py
+#
+# run: python bench/micro_bench.py [output.json]
+
+import os
+import sys
+from timeit import repeat
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_results import save
+from file_cache import FileCache
+from http_req_parser import *
+from parser_bench import REQUESTS
+from path_index import PathIndex
+from resource_locator import ResourceLocator
+
+WWW = os.path.join(os.path.dirname(__file__), "..", "www")
+
+PATHS = {
+    "200": "/deep/index.html",
+    "301": "/deep",
+    "404": "/deep/missing.html",
+}
+
+def ops_per_sec(func, number=20000, runs=5):
+    best = min(repeat(func, number=number, repeat=runs))
+    return number / best
+
+def bench_parse():
+    results = {}
+    for name, request in REQUESTS.items():
+        results[name] = ops_per_sec(lambda: HttpReqParser.parse(request))
+        print(f"parse {name:18} {results[name]:12,.0f}/s")
+
+    return results
+
+def bench_find():
+    # Uncached hits the disk every time, cached is the default
+    # server setup, indexed adds the --index routing
+    setups = {
+        "uncached": (None, None),
+        "cached": (FileCache(), None),
+        "indexed": (FileCache(), PathIndex(WWW)),
+    }
+
+    results = {}
+    for setup, (cache, index) in setups.items():
+        results[setup] = {}
+        for name, path in PATHS.items():
+            rate = ops_per_sec(lambda: ResourceLocator.find(path, WWW, cache, index))
+            results[setup][name] = rate
+            print(f"find  {setup:9} {name}       {rate:12,.0f}/s")
+
+    return results
+
+def run():
+    return {
+        "parse": bench_parse(),
+        "find": bench_find(),
+    }
+
+if __name__ == "__main__":
+    results = run()
+    if len(sys.argv) > 1:
+        save(sys.argv[1], "micro_bench", results)
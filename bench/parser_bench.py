@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compares the bytes-level HttpReqParser against the previous
+# str-based implementation, kept below as LegacyHttpReqParser
+#
+# run: python bench/parser_bench.py
+
+import os
+import sys
+from timeit import repeat
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from http_req_parser import *
+
+REQUESTS = {
+    "curl": (
+        b"GET /index.html HTTP/1.1\r\n"
+        b"Host: 127.0.0.1:8080\r\n"
+        b"User-Agent: curl/7.81.0\r\n"
+        b"Accept: */*\r\n"
+        b"\r\n"
+    ),
+    "browser": (
+        b"GET /deep/index.html HTTP/1.1\r\n"
+        b"Host: 127.0.0.1:8080\r\n"
+        b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:91.0) Gecko/20100101 Firefox/91.0\r\n"
+        b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8\r\n"
+        b"Accept-Language: en-CA,en-US;q=0.7,en;q=0.3\r\n"
+        b"Accept-Encoding: gzip, deflate\r\n"
+        b"Connection: keep-alive\r\n"
+        b"Upgrade-Insecure-Requests: 1\r\n"
+        b"Sec-Fetch-Dest: document\r\n"
+        b"Sec-Fetch-Mode: navigate\r\n"
+        b"Sec-Fetch-Site: none\r\n"
+        b"Sec-Fetch-User: ?1\r\n"
+        b"If-None-Match: \"16a7c505e1dd9e00-1ec\"\r\n"
+        b"If-Modified-Since: Fri, 24 Sep 2021 13:26:59 GMT\r\n"
+        b"Cache-Control: max-age=0\r\n"
+        b"\r\n"
+    ),
+}
+
+class LegacyHttpReqParser(HttpReqParser):
+
+    @classmethod
+    def parse(cls, unparsed_data):
+        parsed_data = {}
+
+        # Check for empty byte string
+        if not unparsed_data:
+            raise BadRequest
+
+        # Decode unparsed data
+        decoded_u_data = unparsed_data.decode("utf-8")
+
+        # Split over CR-LF
+        splitted_data = decoded_u_data.split("\r\n\r\n")
+        splitted_data = splitted_data[0].split("\r\n")
+        splitted_data_len = len(splitted_data)
+        
+        start_line = splitted_data[0]
+        
+        # Check method name
+        start_line = cls.check_strip(
+            start_line,
+            "GET",
+            MethodNotAllowed,
+            strip_end=" "
+        )
+        parsed_data[cls.methodname] = True
+
+        # Get path
+        path = cls.get_substr(
+            start_line,
+            " ",
+            UnsupportedPath
+        )
+
+        if path[0] != "/":
+            raise UnsupportedPath
+
+        start_line = start_line.replace(path+" ", "", 1)
+        parsed_data[cls.pathname] = path
+        
+        # Check HTTP version
+        start_line, http_ver = cls.check_strip_multi(
+            start_line,
+            ["HTTP/1.1", "HTTP/1.0"],
+            UnsupportedHTTPVer,
+            strip_end=" "
+        )
+
+        if splitted_data_len == 1 and http_ver == "HTTP/1.0":
+            raise BadRequest
+
+        parsed_data[cls.httpvername] = http_ver
+
+        fields = splitted_data[1:]
+
+        # Get host
+        host = cls.get_field(fields, "Host")
+        if host is None:
+            raise BadRequest
+
+        parsed_data[cls.hostname] = host
+
+        # Get some other fields (Accept, User-Agent)
+        accept = cls.get_field(fields, "Accept")
+        agent = cls.get_field(fields, "User-Agent")
+        connection = cls.get_field(fields, "Connection")
+        if_none_match = cls.get_field(fields, "If-None-Match")
+        if_modified_since = cls.get_field(fields, "If-Modified-Since")
+        accept_encoding = cls.get_field(fields, "Accept-Encoding")
+
+        parsed_data[cls.acceptname] = accept
+        parsed_data[cls.agentname] = agent
+        parsed_data[cls.connectionname] = connection
+        parsed_data[cls.ifnonematchname] = if_none_match
+        parsed_data[cls.ifmodifiedsincename] = if_modified_since
+        parsed_data[cls.acceptencodingname] = accept_encoding
+
+        return parsed_data
+
+    @classmethod
+    def get_field(cls, fields, field_str):
+        for field in fields:
+            splitted_field = field.split(": ")
+            if len(splitted_field) == 1:
+                raise BadRequest
+            
+            if field_str == splitted_field[0]:
+                return splitted_field[1]
+
+        return None           
+
+    @classmethod
+    def check_strip(cls, target_str, check_str, error,
+        strip_end="", index=0):
+        if target_str.find(check_str) != index:
+            raise error
+
+        return target_str.replace(check_str + strip_end, "", 1)
+
+    @classmethod
+    def check_strip_multi(cls, target_str, check_strs, error,
+        strip_end="", index=0):
+        target_str_len = len(target_str)
+        count = 0
+        for check_str in check_strs:
+            try:
+                stripped_target_str = cls.check_strip(
+                    target_str,
+                    check_str,
+                    error,
+                    strip_end,
+                    index
+                )
+
+                return stripped_target_str, check_str
+
+            except HTTPReqParserException:
+                if count == target_str_len:
+                    raise error
+
+    @classmethod
+    def get_substr(cls, target_str, end, error):
+        substr = ""
+        char = ""
+        for char in target_str:
+            if char == end:
+                return substr
+            
+            substr += char
+
+        raise error
+
+
+def requests_per_sec(parser, request, number=20000, runs=5):
+    best = min(repeat(lambda: parser.parse(request), number=number, repeat=runs))
+    return number / best
+
+def run():
+    results = {}
+    for name, request in REQUESTS.items():
+        before = requests_per_sec(LegacyHttpReqParser, request)
+        after = requests_per_sec(HttpReqParser, request)
+        results[name] = {"before": before, "after": after}
+        print(f"{name:10} before {before:12,.0f} req/s   "
+            f"after {after:12,.0f} req/s   x{after / before:.2f}")
+
+    return results
+
+if __name__ == "__main__":
+    run()
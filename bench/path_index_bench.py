@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compares ResourceLocator.find routing on disk against the
+# PathIndex on a generated tree of 100k files
+#
+# run: python bench/path_index_bench.py [files]
+
+import os
+import sys
+import tempfile
+from time import perf_counter
+from timeit import repeat
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from file_cache import FileCache
+from path_index import PathIndex
+from resource_locator import ResourceLocator
+
+FILES_PER_DIR = 100
+
+def make_tree(root, files):
+    for i in range(files // FILES_PER_DIR):
+        dir_path = os.path.join(root, f"d{i}")
+        os.mkdir(dir_path)
+        for j in range(FILES_PER_DIR):
+            with open(os.path.join(dir_path, f"f{j}.html"), "wb") as file_descr:
+                file_descr.write(b"<p>%d</p>" % j)
+
+def lookups_per_sec(path, root, cache, index, number=20000, runs=5):
+    best = min(repeat(
+        lambda: ResourceLocator.find(path, root, cache, index),
+        number=number,
+        repeat=runs
+    ))
+    return number / best
+
+def run(files=100000):
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        start = perf_counter()
+        make_tree(root, files)
+        print(f"created {files} files in {perf_counter() - start:.1f}s")
+
+        start = perf_counter()
+        index = PathIndex(root)
+        build_time = perf_counter() - start
+        print(f"indexed {len(index)} entries in {build_time:.2f}s")
+        results["build_seconds"] = build_time
+
+        # Files come from a warm cache in both cases so only
+        # the routing decision differs
+        cache = FileCache()
+        cases = {
+            "200": "/d7/f42.html",
+            "301": "/d7",
+            "404": "/d7/missing.html",
+        }
+        for name, path in cases.items():
+            before = lookups_per_sec(path, root, cache, None)
+            after = lookups_per_sec(path, root, cache, index)
+            results[name] = {"before": before, "after": after}
+            print(f"{name}  on disk {before:12,.0f}/s   "
+                f"indexed {after:12,.0f}/s   x{after / before:.2f}")
+
+    return results
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
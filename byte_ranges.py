@@ -0,0 +1,105 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from resource_locator import FileBody
+from uuid import uuid4
+
+# More ranges than this in one request are ignored and the
+# whole body is sent, so a client cannot ask for thousands
+# of tiny overlapping pieces
+MAX_RANGES = 16
+
+BOUNDARY = uuid4().hex
+
+def parse_ranges(range_spec, size):
+    # Returns a sorted list of inclusive (start, end) pairs, [] when
+    # no range can be satisfied (416), or None when the header is
+    # malformed or unsupported and should be ignored (200)
+    unit, _, ranges_str = range_spec.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+
+    ranges = []
+    for range_str in ranges_str.split(","):
+        first, dash, last = range_str.strip().partition("-")
+        if not dash:
+            return None
+
+        try:
+            if first:
+                start = int(first)
+                end = size - 1
+                if last:
+                    end = int(last)
+                    if end < start:
+                        return None
+
+            else:
+                # "-500" is the last 500 bytes
+                suffix = int(last)
+                start = max(size - suffix, 0)
+                end = size - 1
+                if suffix == 0:
+                    continue
+
+        except ValueError:
+            return None
+
+        if start < 0:
+            return None
+
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    return coalesce(ranges)
+
+def coalesce(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+def slice_body(payload, start, end):
+    # Neither case copies file data: files become an offset
+    # for sendfile, cached bodies a memoryview
+    if isinstance(payload, FileBody):
+        return FileBody(payload.path, payload.offset + start, end - start + 1)
+
+    return memoryview(payload)[start:end + 1]
+
+def content_range(start, end, size):
+    return f"bytes {start}-{end}/{size}"
+
+def multipart_body(payload, ranges, content_type, size):
+    # multipart/byteranges from RFC 7233 appendix A; the file
+    # parts stay FileBody slices between the byte string parts
+    parts = []
+    for start, end in ranges:
+        parts.append((
+            f"\r\n--{BOUNDARY}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: {content_range(start, end, size)}\r\n"
+            "\r\n"
+        ).encode())
+        parts.append(slice_body(payload, start, end))
+
+    parts.append(f"\r\n--{BOUNDARY}--\r\n".encode())
+    return f"multipart/byteranges; boundary={BOUNDARY}", parts
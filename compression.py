@@ -0,0 +1,162 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import os
+import zlib
+from file_cache import ENTRY_OVERHEAD, LruCache
+from functools import lru_cache
+from resource_locator import FileBody
+
+# Encodings we can produce, in order of preference
+SUPPORTED_ENCODINGS = ("gzip", "deflate")
+
+# Told apart from a cached None, which means compressing did not
+# make the body smaller
+MISSING = object()
+
+@lru_cache(maxsize=128)
+def choose_encoding(accept_encoding):
+    if not accept_encoding:
+        return None
+
+    qvalues = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if coding == "x-gzip":
+            coding = "gzip"
+
+        qvalue = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                qvalue = float(params[2:])
+            except ValueError:
+                qvalue = 0.0
+
+        qvalues[coding] = qvalue
+
+    best, best_q = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        qvalue = qvalues.get(encoding, qvalues.get("*", 0.0))
+        if qvalue > best_q:
+            best, best_q = encoding, qvalue
+
+    return best
+
+class Compressor:
+    # File types worth compressing; images and archives
+    # are already compressed
+    compressible_types = {
+        "html", "htm", "css", "js", "mjs", "json", "txt",
+        "svg", "xml", "csv", "md"
+    }
+
+    def __init__(self, min_size=256, max_bytes=16 * 1024 * 1024,
+        max_entry_bytes=1024 * 1024, level=6):
+        # Bodies smaller than this gain less than the
+        # Content-Encoding header costs
+        self.min_size = min_size
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.level = level
+
+        # (path, etag, encoding) -> compressed body, or None when
+        # compressing did not make the body smaller
+        self.variants = LruCache(max_bytes, self.get_cost)
+
+    def is_compressible(self, resource):
+        return (
+            resource.filetype.lower() in self.compressible_types
+            and resource.size >= self.min_size
+        )
+
+    def get_variant(self, resource, payload, encoding):
+        key = (resource.path, resource.etag, encoding)
+        variant = self.variants.get(key, MISSING)
+        if variant is not MISSING:
+            self.variants.hit()
+            return variant
+
+        self.variants.miss()
+
+        variant = self.find_precompressed(resource, encoding)
+        if variant is None and self.can_compress(payload):
+            # Large streamed files are only served compressed
+            # when a precompressed sibling exists on disk
+            variant = self.compress(payload, encoding)
+            if len(variant) >= len(payload):
+                variant = None
+
+        elif variant is None:
+            # Streamed from disk; only sent compressed when a
+            # precompressed sibling appears
+            return None
+
+        self.put(key, variant)
+        return variant
+
+    def can_compress(self, payload):
+        # Mapped files too large for a cached variant would be
+        # compressed again on every request
+        if isinstance(payload, memoryview):
+            return len(payload) <= self.max_entry_bytes
+
+        return isinstance(payload, bytes)
+
+    def find_precompressed(self, resource, encoding):
+        if encoding != "gzip":
+            return None
+
+        gz_path = resource.path + ".gz"
+        try:
+            stat = os.stat(gz_path)
+        except OSError:
+            return None
+
+        # A sibling older than the file it compresses is stale
+        if stat.st_mtime_ns < resource.mtime_ns:
+            return None
+
+        if stat.st_size > self.max_entry_bytes:
+            return FileBody(gz_path, 0, stat.st_size)
+
+        with open(gz_path, "rb") as file_descr:
+            return file_descr.read()
+
+    def compress(self, payload, encoding):
+        if encoding == "gzip":
+            # mtime=0 keeps the output identical across runs
+            return gzip.compress(payload, self.level, mtime=0)
+
+        return zlib.compress(payload, self.level)
+
+    def get_cost(self, variant):
+        if isinstance(variant, bytes):
+            return ENTRY_OVERHEAD + len(variant)
+
+        return ENTRY_OVERHEAD
+
+    def put(self, key, variant):
+        if self.get_cost(variant) - ENTRY_OVERHEAD > self.max_entry_bytes:
+            return
+
+        self.variants.put(key, variant)
+
+    def clear(self):
+        self.variants.clear()
+
+    def stats(self):
+        return self.variants.stats()
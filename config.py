@@ -0,0 +1,185 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import configparser
+import os
+import tomllib
+
+# Environment variables are the option name in capitals with
+# this prefix, e.g. --keep-alive-timeout is WEBSERVER_KEEP_ALIVE_TIMEOUT
+ENV_PREFIX = "WEBSERVER_"
+
+# Section read from INI files; TOML files may use it or put
+# the settings at the top level
+SECTION = "server"
+
+TRUE_STRINGS = {"1", "true", "yes", "on"}
+FALSE_STRINGS = {"0", "false", "no", "off"}
+
+class ConfigError(Exception):
+    pass
+
+# Settings are resolved in order: built-in defaults, then the
+# config file, then the environment, then the command line. The
+# argparse parser describes every setting, so file and environment
+# values are converted and checked exactly like flags
+def load_config(parser, argv=None):
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("--config")
+    known, _ = pre_parser.parse_known_args(argv)
+    config_path = known.config or os.environ.get(ENV_PREFIX + "CONFIG")
+
+    actions = {
+        action.dest: action
+        for action in parser._actions
+        if action.option_strings and action.dest not in ("help", "config")
+    }
+
+    try:
+        settings = {}
+        if config_path:
+            settings.update(read_file(config_path))
+
+        settings.update(read_environment(actions))
+
+        defaults = {}
+        for name, value in settings.items():
+            dest = name.replace("-", "_")
+            if dest not in actions:
+                raise ConfigError(f"unknown setting: {name}")
+
+            defaults[dest] = convert(actions[dest], value)
+
+    except ConfigError as e:
+        parser.error(str(e))
+
+    # argparse appends flags to an option's default list, so the
+    # file and environment lists are applied only when the command
+    # line gives none, and are replaced rather than added to
+    lists = {}
+    for dest, action in actions.items():
+        if isinstance(action, argparse._AppendAction):
+            lists[dest] = defaults.pop(dest, action.default)
+            defaults[dest] = None
+
+    parser.set_defaults(**defaults)
+    args = parser.parse_args(argv)
+    for dest, value in lists.items():
+        if getattr(args, dest) is None:
+            setattr(args, dest, value)
+
+    return args
+
+def read_file(path):
+    try:
+        if path.endswith((".ini", ".cfg", ".conf")):
+            config = configparser.ConfigParser()
+            with open(path) as file_descr:
+                config.read_file(file_descr)
+            if not config.has_section(SECTION):
+                return {}
+            return dict(config.items(SECTION))
+
+        with open(path, "rb") as file_descr:
+            data = tomllib.load(file_descr)
+
+    except OSError as e:
+        raise ConfigError(f"cannot read {path}: {e.strerror}")
+    except (configparser.Error, tomllib.TOMLDecodeError) as e:
+        raise ConfigError(f"cannot parse {path}: {e}")
+
+    return data.get(SECTION, data)
+
+def read_environment(actions):
+    settings = {}
+    for dest in actions:
+        value = os.environ.get(ENV_PREFIX + dest.upper())
+        if value is not None:
+            settings[dest] = value
+
+    return settings
+
+def convert(action, value):
+    name = action.option_strings[0]
+
+    # store_true / store_false flags
+    if action.nargs == 0:
+        if isinstance(value, bool):
+            return value
+        if str(value).lower() in TRUE_STRINGS:
+            return True
+        if str(value).lower() in FALSE_STRINGS:
+            return False
+        raise ConfigError(f"{name} expects true or false, got {value!r}")
+
+    if isinstance(action, argparse._AppendAction):
+        if isinstance(value, str):
+            value = [item.strip() for item in value.split(",") if item.strip()]
+        elif not isinstance(value, list):
+            value = [value]
+
+        return [convert_one(action, name, item) for item in value]
+
+    return convert_one(action, name, value)
+
+def convert_one(action, name, value):
+    if isinstance(value, (list, dict)):
+        raise ConfigError(f"{name} expects a single value, got {value!r}")
+
+    try:
+        if action.type is not None:
+            value = action.type(value)
+        else:
+            value = str(value)
+    except (TypeError, ValueError):
+        raise ConfigError(f"{name} got an invalid value {value!r}")
+
+    if action.choices is not None and value not in action.choices:
+        raise ConfigError(
+            f"{name} must be one of {', '.join(map(str, action.choices))}, got {value!r}"
+        )
+
+    return value
+
+def parse_listen(address, default_port=8080):
+    # "host:port", "[v6 address]:port", ":port" (all IPv4
+    # interfaces), "[::]:port" (every interface) or a bare host
+    if address.startswith("["):
+        host, bracket, rest = address[1:].partition("]")
+        if not bracket or (rest and not rest.startswith(":")):
+            raise ConfigError(f"invalid listen address: {address}")
+        port = rest[1:]
+
+    elif address.count(":") > 1:
+        raise ConfigError(f"IPv6 listen addresses need brackets: {address}")
+
+    else:
+        host, _, port = address.partition(":")
+
+    try:
+        port = int(port) if port else default_port
+    except ValueError:
+        raise ConfigError(f"invalid port in listen address: {address}")
+
+    if not 0 < port < 65536:
+        raise ConfigError(f"port out of range in listen address: {address}")
+
+    return host or "0.0.0.0", port
+
+def format_url(host, port, scheme="http"):
+    if ":" in host:
+        host = f"[{host}]"
+
+    return f"{scheme}://{host}:{port}"
@@ -0,0 +1,173 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from time import monotonic
+
+# Rough memory cost of an entry that only holds metadata
+ENTRY_OVERHEAD = 256
+
+# Least recently used mapping whose values together cost at most
+# max_cost, as measured by cost(value). Shared by the file cache,
+# the compression cache, the mmap store and the directory
+# listings; each of them decides what counts as a hit or a miss
+class LruCache:
+
+    def __init__(self, max_cost, cost):
+        self.max_cost = max_cost
+        self.cost = cost
+
+        self.items = OrderedDict()
+        self.total_cost = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items[key]
+            except KeyError:
+                return default
+
+            self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        cost = self.cost(value)
+        if cost > self.max_cost:
+            return
+
+        with self.lock:
+            if key in self.items:
+                self.total_cost -= self.cost(self.items.pop(key))
+
+            self.items[key] = value
+            self.total_cost += cost
+
+            # Evict least recently used values until under budget
+            while self.total_cost > self.max_cost:
+                _, evicted = self.items.popitem(last=False)
+                self.total_cost -= self.cost(evicted)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self.lock:
+            if key in self.items:
+                self.total_cost -= self.cost(self.items.pop(key))
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.total_cost = 0
+
+    def hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.items),
+                "bytes": self.total_cost,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+class CacheEntry:
+    __slots__ = (
+        "path", "body", "filetype", "size", "mtime_ns",
+        "etag", "last_modified", "cost", "checked"
+    )
+
+    # body is None for files too large to keep in memory,
+    # their metadata is still cached so they can be streamed
+    # without another stat
+    def __init__(self, path, body, filetype, size, mtime_ns):
+        self.path = path
+        self.body = body
+        self.filetype = filetype
+        self.size = size
+        self.mtime_ns = mtime_ns
+        # Strong validator: changes whenever the size or mtime does
+        self.etag = f'"{mtime_ns:x}-{size:x}"'
+        self.last_modified = formatdate(mtime_ns // 10**9, usegmt=True)
+        self.cost = ENTRY_OVERHEAD + (len(body) if body is not None else 0)
+        # monotonic() time of the last stat() against the file
+        self.checked = monotonic()
+
+class FileCache:
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=1024 * 1024,
+        revalidate_interval=1.0):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        # Entries checked less than this many seconds ago are served
+        # without touching the disk at all
+        self.revalidate_interval = revalidate_interval
+
+        self.entries = LruCache(max_bytes, lambda entry: entry.cost)
+
+    def get(self, path):
+        entry = self.entries.get(path)
+        if entry is None:
+            self.entries.miss()
+            return None
+
+        now = monotonic()
+        if now - entry.checked >= self.revalidate_interval:
+            if not self.is_fresh(entry):
+                self.invalidate(path)
+                self.entries.miss()
+                return None
+
+            entry.checked = now
+
+        self.entries.hit()
+        return entry
+
+    def put(self, entry):
+        if entry.body is not None and len(entry.body) > self.max_entry_bytes:
+            return
+
+        self.entries.put(entry.path, entry)
+
+    def invalidate(self, path):
+        self.entries.pop(path)
+
+    def clear(self):
+        self.entries.clear()
+
+    def is_fresh(self, entry):
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            return False
+
+        return stat.st_mtime_ns == entry.mtime_ns and stat.st_size == entry.size
+
+    def stats(self):
+        return self.entries.stats()
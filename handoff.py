@@ -0,0 +1,112 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import select
+import socket
+import subprocess
+import sys
+
+# A restart starts the new process with the listening sockets
+# already open, their descriptor numbers listed in LISTEN_FDS_ENV.
+# It writes to the pipe in READY_FD_ENV once it is serving, and
+# only then does the old process stop accepting. The sockets stay
+# open throughout, so connections queue in the backlog instead of
+# being refused
+LISTEN_FDS_ENV = "WEBSERVER_LISTEN_FDS"
+READY_FD_ENV = "WEBSERVER_READY_FD"
+
+# Seconds the old process waits for its successor
+READY_TIMEOUT = 30
+
+# Bound (host, port) -> listening socket handed over at startup
+inherited = {}
+
+def adopt_listeners():
+    # Removed from the environment so processes started by this
+    # one do not try to adopt the same descriptors
+    fds = os.environ.pop(LISTEN_FDS_ENV, "")
+    for fd in fds.split(","):
+        if fd:
+            sock = socket.socket(fileno=int(fd))
+            inherited[sock.getsockname()[:2]] = sock
+
+def take_listener(address):
+    # The inherited socket bound to address, or None to bind anew
+    if not inherited:
+        return None
+
+    try:
+        infos = socket.getaddrinfo(
+            address[0],
+            address[1],
+            type=socket.SOCK_STREAM,
+            flags=socket.AI_PASSIVE
+        )
+    except socket.gaierror:
+        return None
+
+    for *_, sockaddr in infos:
+        sock = inherited.pop(sockaddr[:2], None)
+        if sock is not None:
+            return sock
+
+    return None
+
+def notify_ready():
+    # Called once every listener is set up. Inherited sockets
+    # left over are addresses the new configuration dropped
+    for sock in inherited.values():
+        sock.close()
+    inherited.clear()
+
+    fd = os.environ.pop(READY_FD_ENV, None)
+    if fd is not None:
+        os.write(int(fd), b"1")
+        os.close(int(fd))
+
+def spawn_successor(sockets, timeout=READY_TIMEOUT):
+    # Starts this program again, with the same interpreter flags
+    # and arguments, handing it the listening sockets. Returns
+    # True once it is serving; on False the old process should
+    # carry on as if nothing happened
+    read_fd, write_fd = os.pipe()
+    fds = [sock.fileno() for sock in sockets]
+    env = dict(os.environ)
+    env[LISTEN_FDS_ENV] = ",".join(map(str, fds))
+    env[READY_FD_ENV] = str(write_fd)
+
+    try:
+        process = subprocess.Popen(
+            [sys.executable, *sys.orig_argv[1:]],
+            pass_fds=[*fds, write_fd],
+            env=env
+        )
+    except OSError:
+        os.close(read_fd)
+        return False
+    finally:
+        os.close(write_fd)
+
+    # A successor that fails to start closes the pipe by exiting
+    try:
+        ready, _, _ = select.select([read_fd], [], [], timeout)
+        ok = bool(ready) and os.read(read_fd, 1) == b"1"
+    finally:
+        os.close(read_fd)
+
+    if not ok:
+        process.kill()
+
+    return ok
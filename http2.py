@@ -0,0 +1,271 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from resource_locator import FileBody
+from streaming import StreamingResponse, iterate_async
+from time import perf_counter_ns
+
+# HTTP/2 framing and HPACK come from the optional h2 package;
+# without it the server only speaks HTTP/1.x
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+    import h2.settings
+except ImportError:
+    h2 = None
+
+# HTTP/1.1 connection management fields have no meaning in HTTP/2
+HOP_BY_HOP = {b"connection", b"keep-alive", b"transfer-encoding"}
+
+FILE_CHUNK = 64 * 1024
+
+# One HTTP/2 connection on the asyncio engine. Every stream is
+# answered by its own task, and each is turned into an HTTP/1.1
+# request head for HttpResponder, so lookups, negotiation and
+# caching are shared with the HTTP/1.x path
+class Http2Connection:
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.conn = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False, header_encoding=None)
+        )
+        # stream id -> task answering it
+        self.streams = {}
+        # Set whenever the peer opens a flow control window
+        self.window_opened = asyncio.Event()
+
+    async def serve(self):
+        self.conn.local_settings = h2.settings.Settings(
+            client=False,
+            initial_values={
+                h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: 100,
+                h2.settings.SettingCodes.MAX_HEADER_LIST_SIZE: self.server.max_header_size,
+            }
+        )
+        self.conn.initiate_connection()
+        self.flush()
+
+        try:
+            while True:
+                if self.server.draining and not self.streams:
+                    self.conn.close_connection()
+                    self.flush()
+                    break
+
+                try:
+                    data = await asyncio.wait_for(
+                        self.reader.read(65536),
+                        self.server.keep_alive_timeout
+                    )
+                except asyncio.TimeoutError:
+                    if self.streams:
+                        continue
+
+                    self.conn.close_connection()
+                    self.flush()
+                    break
+
+                if not data:
+                    break
+
+                try:
+                    events = self.conn.receive_data(data)
+                except h2.exceptions.ProtocolError:
+                    # h2 has queued the GOAWAY explaining why
+                    self.flush()
+                    break
+
+                if not self.handle_events(events):
+                    break
+
+                self.flush()
+
+        finally:
+            for task in self.streams.values():
+                task.cancel()
+
+    def handle_events(self, events):
+        for event in events:
+            if isinstance(event, h2.events.RequestReceived):
+                self.streams[event.stream_id] = asyncio.create_task(
+                    self.respond(event.stream_id, event.headers)
+                )
+
+            elif isinstance(event, h2.events.DataReceived):
+                # GET and HEAD carry no body; keep the window open
+                self.conn.acknowledge_received_data(
+                    event.flow_controlled_length,
+                    event.stream_id
+                )
+
+            elif isinstance(event, h2.events.StreamReset):
+                task = self.streams.pop(event.stream_id, None)
+                if task is not None:
+                    task.cancel()
+
+            elif isinstance(event, (h2.events.WindowUpdated, h2.events.RemoteSettingsChanged)):
+                self.window_opened.set()
+
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                return False
+
+        return True
+
+    def flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.writer.write(data)
+
+    async def respond(self, stream_id, headers):
+        start = sending = perf_counter_ns()
+        sent = 0
+        summary = None
+        marks = None
+        admission = self.server.admission
+        try:
+            rejection = None
+            if admission is not None:
+                rejection = admission.check_request(self.peer())
+
+            if rejection is not None:
+                head, body, _, summary = self.server.process_rejection(*rejection)
+                await self.send_response(stream_id, head, body)
+
+            else:
+                try:
+                    head, body, _, summary = self.server.process_request(
+                        self.make_request_head(headers),
+                        True,
+                        True
+                    )
+                    if self.server.profiler is not None:
+                        marks = self.server.marks
+                    sending = perf_counter_ns()
+                    sent = await self.send_response(stream_id, head, body)
+                finally:
+                    if admission is not None:
+                        admission.request_finished((perf_counter_ns() - start) / 1e9)
+
+        except (h2.exceptions.StreamClosedError, ConnectionError):
+            # The peer reset the stream or went away mid-response
+            pass
+
+        finally:
+            self.streams.pop(stream_id, None)
+
+        if summary is not None:
+            # HttpResponder saw the HTTP/1.1 translation
+            summary = (*summary[:2], "HTTP/2", *summary[3:])
+            if self.server.metrics is not None:
+                self.server.metrics.observe_send(start, sending, sent)
+            if marks is not None:
+                self.server.profiler.observe(summary, start, *marks, sending, perf_counter_ns())
+            self.server.log_access(self.writer, summary, sent, perf_counter_ns() - start)
+
+    def peer(self):
+        peer = self.writer.get_extra_info("peername")
+        return peer[0] if peer else "-"
+
+    def make_request_head(self, headers):
+        method = path = b""
+        lines = []
+        for name, value in headers:
+            if name == b":method":
+                method = value
+            elif name == b":path":
+                path = value
+            elif name == b":authority":
+                lines.append(b"Host: " + value)
+            elif not name.startswith(b":"):
+                lines.append(name + b": " + value)
+
+        return b"\r\n".join([method + b" " + path + b" HTTP/1.1", *lines, b"", b""])
+
+    async def send_response(self, stream_id, head, body):
+        # Returns the body bytes sent
+        lines = head.split(b"\r\n")
+        headers = [(b":status", lines[0].split(b" ", 2)[1])]
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(b":")
+                name = name.strip().lower()
+                if name not in HOP_BY_HOP:
+                    headers.append((name, value.strip()))
+
+        empty = not isinstance(body, StreamingResponse) and self.server.get_length(body) == 0
+        self.conn.send_headers(stream_id, headers, end_stream=empty)
+        self.flush()
+        if empty:
+            await self.writer.drain()
+            return 0
+
+        sent = 0
+        async for chunk in self.body_chunks(body):
+            await self.send_data(stream_id, chunk)
+            sent += len(chunk)
+
+        self.conn.end_stream(stream_id)
+        self.flush()
+        await self.writer.drain()
+        return sent
+
+    async def body_chunks(self, body):
+        if isinstance(body, StreamingResponse):
+            # Chunked framing is HTTP/1.1 only; DATA frames
+            # already delimit the pieces
+            async for chunk in iterate_async(body.chunks):
+                if chunk:
+                    yield chunk
+            return
+
+        for part in body if isinstance(body, list) else [body]:
+            if not isinstance(part, FileBody):
+                yield part
+                continue
+
+            with open(part.path, "rb") as file_descr:
+                file_descr.seek(part.offset)
+                remaining = part.count
+                while remaining > 0:
+                    chunk = file_descr.read(min(FILE_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+    async def send_data(self, stream_id, data):
+        # Sends as much as the stream and connection windows allow,
+        # then waits for the peer to open them again
+        view = memoryview(data)
+        while view:
+            size = min(
+                self.conn.local_flow_control_window(stream_id),
+                self.conn.max_outbound_frame_size,
+                len(view)
+            )
+            if size <= 0:
+                self.window_opened.clear()
+                await self.window_opened.wait()
+                continue
+
+            self.conn.send_data(stream_id, view[:size].tobytes())
+            view = view[size:]
+            self.flush()
+            await self.writer.drain()
@@ -12,6 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
+
+# A block of "name: value" lines joined by CRLF. Names are tokens
+# (RFC 9110 5.1), so whitespace before the colon or a folded
+# continuation line fails to match; values may hold any character
+# but controls other than HTAB, which rules out bare CR, LF and NUL
+FIELD_LINE = r"[!#$%&'*+.^_`|~0-9A-Za-z-]+:[\t\x20-\x7e\x80-\xff]*"
+FIELD_BLOCK = re.compile(f"{FIELD_LINE}(?:\r\n{FIELD_LINE})*")
+
 class HTTPReqParserException(Exception):
 
     def __init__(self, message=""):
@@ -29,6 +38,12 @@ class UnsupportedPath(HTTPReqParserException):
 class BadRequest(HTTPReqParserException):
     pass
 
+class RequestHeaderFieldsTooLarge(HTTPReqParserException):
+    pass
+
+class RequestTimeout(HTTPReqParserException):
+    pass
+
 class HttpReqParser:
     methodname = "HTTP_METHOD"
     pathname = "PATH"
@@ -36,6 +51,43 @@ class HttpReqParser:
     hostname = "HOST"
     agentname = "AGENT"
     acceptname = "ACCEPT"
+    connectionname = "CONNECTION"
+    ifnonematchname = "IF_NONE_MATCH"
+    ifmodifiedsincename = "IF_MODIFIED_SINCE"
+    acceptencodingname = "ACCEPT_ENCODING"
+    rangename = "RANGE"
+    ifrangename = "IF_RANGE"
+    contentlengthname = "CONTENT_LENGTH"
+
+    headersname = "HEADERS"
+
+    # Lowercase header name -> key it is stored under
+    fieldnames = {
+        "host": hostname,
+        "accept": acceptname,
+        "user-agent": agentname,
+        "connection": connectionname,
+        "if-none-match": ifnonematchname,
+        "if-modified-since": ifmodifiedsincename,
+        "accept-encoding": acceptencodingname,
+        "range": rangename,
+        "if-range": ifrangename,
+    }
+
+    supported_methods = {
+        b"GET": "GET",
+        b"HEAD": "HEAD",
+    }
+
+    supported_versions = {
+        b"HTTP/1.1": "HTTP/1.1",
+        b"HTTP/1.0": "HTTP/1.0",
+    }
+
+    # Longest request line or header line accepted
+    max_line_length = 8190
+    # Most header fields accepted in one request
+    max_headers = 100
 
     @classmethod
     def parse(cls, unparsed_data):
@@ -45,121 +97,103 @@ class HttpReqParser:
         if not unparsed_data:
             raise BadRequest
 
-        # Decode unparsed data
-        decoded_u_data = unparsed_data.decode("utf-8")
+        # bytes and bytearray share find/partition, memoryview does not
+        if isinstance(unparsed_data, memoryview):
+            unparsed_data = unparsed_data.tobytes()
+
+        # Everything after the blank line is body, never scanned
+        end = unparsed_data.find(b"\r\n\r\n")
+        if end == -1:
+            end = len(unparsed_data)
+
+        line_end = unparsed_data.find(b"\r\n", 0, end)
+        if line_end == -1:
+            line_end = end
+
+        if line_end > cls.max_line_length:
+            raise BadRequest
 
-        # Split over CR-LF
-        splitted_data = decoded_u_data.split("\r\n\r\n")
-        splitted_data = splitted_data[0].split("\r\n")
-        splitted_data_len = len(splitted_data)
-        
-        start_line = splitted_data[0]
-        
         # Check method name
-        start_line = cls.check_strip(
-            start_line,
-            "GET",
-            MethodNotAllowed,
-            strip_end=" "
-        )
-        parsed_data[cls.methodname] = True
+        method, _, rest = unparsed_data[:line_end].partition(b" ")
+        method = cls.supported_methods.get(method)
+        if method is None:
+            raise MethodNotAllowed
+        parsed_data[cls.methodname] = method
 
         # Get path
-        path = cls.get_substr(
-            start_line,
-            " ",
-            UnsupportedPath
-        )
-
-        if path[0] != "/":
+        path, space, version = rest.partition(b" ")
+        if not space or path[:1] != b"/":
             raise UnsupportedPath
 
-        start_line = start_line.replace(path+" ", "", 1)
-        parsed_data[cls.pathname] = path
-        
-        # Check HTTP version
-        start_line, http_ver = cls.check_strip_multi(
-            start_line,
-            ["HTTP/1.1", "HTTP/1.0"],
-            UnsupportedHTTPVer,
-            strip_end=" "
-        )
-
-        if splitted_data_len == 1 and http_ver == "HTTP/1.0":
+        try:
+            parsed_data[cls.pathname] = path.decode("utf-8")
+        except UnicodeDecodeError:
             raise BadRequest
 
+        # Check HTTP version
+        http_ver = cls.supported_versions.get(version)
+        if http_ver is None:
+            raise UnsupportedHTTPVer
         parsed_data[cls.httpvername] = http_ver
 
-        fields = splitted_data[1:]
+        headers = cls.parse_fields(unparsed_data, line_end + 2, end)
+        parsed_data[cls.headersname] = headers
 
         # Get host
-        host = cls.get_field(fields, "Host")
-        if host is None:
+        if "host" not in headers:
             raise BadRequest
 
-        parsed_data[cls.hostname] = host
+        for name, key in cls.fieldnames.items():
+            parsed_data[key] = headers.get(name)
 
-        # Get some other fields (Accept, User-Agent)
-        accept = cls.get_field(fields, "Accept")
-        agent = cls.get_field(fields, "User-Agent")
+        # Bodies are never read, so a chunked one could not be
+        # told apart from the next request on the connection
+        if "transfer-encoding" in headers:
+            raise BadRequest
 
-        parsed_data[cls.acceptname] = accept
-        parsed_data[cls.agentname] = agent
+        # Repeated fields were joined with ", ", so "5, 5" is
+        # refused along with anything else that is not one number
+        content_length = headers.get("content-length", "0")
+        if not (content_length.isascii() and content_length.isdigit()):
+            raise BadRequest
+        parsed_data[cls.contentlengthname] = int(content_length)
 
         return parsed_data
 
     @classmethod
-    def get_field(cls, fields, field_str):
-        for field in fields:
-            splitted_field = field.split(": ")
-            if len(splitted_field) == 1:
-                raise BadRequest
-            
-            if field_str == splitted_field[0]:
-                return splitted_field[1]
+    def parse_fields(cls, data, start, end):
+        headers = {}
+        if start >= end:
+            return headers
+
+        # Field values are ISO-8859-1 on the wire, so one decode
+        # of the whole block can never fail and one split finds
+        # every line
+        block = data[start:end].decode("latin-1")
+        if not FIELD_BLOCK.fullmatch(block):
+            raise BadRequest
 
-        return None           
+        lines = block.split("\r\n")
+        if len(lines) > cls.max_headers:
+            raise BadRequest
 
-    @classmethod
-    def check_strip(cls, target_str, check_str, error,
-        strip_end="", index=0):
-        if target_str.find(check_str) != index:
-            raise error
+        for line in lines:
+            if len(line) > cls.max_line_length:
+                raise BadRequest
 
-        return target_str.replace(check_str + strip_end, "", 1)
+            name, _, value = line.partition(":")
+            name = name.lower()
+            value = value.strip(" \t")
 
-    @classmethod
-    def check_strip_multi(cls, target_str, check_strs, error,
-        strip_end="", index=0):
-        target_str_len = len(target_str)
-        count = 0
-        for check_str in check_strs:
-            try:
-                stripped_target_str = cls.check_strip(
-                    target_str,
-                    check_str,
-                    error,
-                    strip_end,
-                    index
-                )
-
-                return stripped_target_str, check_str
-
-            except HTTPReqParserException:
-                if count == target_str_len:
-                    raise error
+            if name not in headers:
+                headers[name] = value
+            elif name == "host":
+                raise BadRequest
+            else:
+                # Repeated fields are one comma-separated list
+                headers[name] += ", " + value
 
-    @classmethod
-    def get_substr(cls, target_str, end, error):
-        substr = ""
-        char = ""
-        for char in target_str:
-            if char == end:
-                return substr
-            
-            substr += char
-
-        raise error
+        return headers
 
 # DEBUG CODE:
 # Uncomment and run http_req_parser.py
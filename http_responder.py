@@ -0,0 +1,521 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from http_req_parser import *
+from byte_ranges import content_range, multipart_body, parse_ranges, slice_body
+from compression import Compressor, choose_encoding
+from file_cache import FileCache
+from metrics import PROMETHEUS_TYPE, Metrics
+from mime_types import MimeRegistry, accepts
+from resource_locator import ResourceLocator
+from response_builder import ResponseBuilder
+from streaming import StreamingResponse
+from email.utils import parsedate_to_datetime
+import re
+from time import perf_counter_ns
+from urllib.parse import parse_qs
+
+# A Host header that is safe to echo back in Location:
+# a name or IPv4 address, or a bracketed IPv6 address, and a port
+HOST_PATTERN = re.compile(r"([A-Za-z0-9.-]+|\[[0-9A-Fa-f:.]+\])(:[0-9]{1,5})?")
+
+# Turns raw request bytes into raw response bytes. Shared by
+# the socketserver handler in server.py and the asyncio engine
+# in async_server.py so both send exactly the same responses
+class HttpResponder:
+
+    basepath = "www"
+    # Redirects use the request's Host header; this is only
+    # used when that header does not match HOST_PATTERN
+    baseurl = "http://127.0.0.1:8080"
+    default_http_ver = "HTTP/1.1"
+    charset = "utf-8"
+    # Idle seconds before a persistent connection is closed
+    keep_alive_timeout = 5
+    # Requests served on one connection before it is closed
+    max_keep_alive_requests = 100
+    # Largest request head accepted, in bytes
+    max_header_size = 16384
+    # Seconds a client has to finish sending a request head
+    request_timeout = 10
+    # Bodies of small, frequently requested files; set to
+    # None to always read from disk
+    file_cache = FileCache()
+    # PathIndex of basepath used to route requests without
+    # touching the disk; None looks every path up on disk
+    path_index = None
+    # VirtualHosts choosing the root, cache and index by the Host
+    # header; None serves every host from the three above
+    virtual_hosts = None
+    # (rule, max-age seconds) pairs; a rule is either a URL path
+    # prefix like "/deep/" or an extension like ".css". The first
+    # matching rule decides the Cache-Control header
+    cache_control_rules = []
+    # File extension -> precomputed Content-Type values
+    mime_registry = MimeRegistry(charset)
+    # Negotiates Content-Encoding and caches compressed bodies;
+    # set to None to always send the identity encoding
+    compressor = Compressor()
+    # MmapStore serving large files from shared read-only
+    # mappings; None reads or sendfile()s them instead
+    mmap_store = None
+    # Prebuilt status lines and header blocks; rebuild it after
+    # changing the keep-alive settings
+    builder = ResponseBuilder(keep_alive_timeout, max_keep_alive_requests)
+
+    # Request counters and phase latencies served on /metrics;
+    # set to None to record nothing
+    metrics = Metrics()
+
+    # Admission deciding which connections and requests are
+    # served; None serves everything
+    admission = None
+    # AccessLog receiving one record per response; None logs nothing
+    access_log = None
+    # Profiler sampling requests and timing their phases; None
+    # profiles nothing
+    profiler = None
+    # Autoindex listing directories that have no index file;
+    # None answers them with 404
+    autoindex = None
+
+    # URL path -> handler(parsed_data) returning a StreamingResponse,
+    # for generated content; see add_route
+    routes = {}
+
+    error_codes = {
+        MethodNotAllowed: 405,
+        UnsupportedHTTPVer: 505,
+        UnsupportedPath: 404,
+        BadRequest: 400,
+        RequestTimeout: 408,
+        RequestHeaderFieldsTooLarge: 431,
+    }
+
+    httpvername = HttpReqParser.httpvername
+    pathname = HttpReqParser.pathname
+    hostname = HttpReqParser.hostname
+    agentname = HttpReqParser.agentname
+    acceptname = HttpReqParser.acceptname
+    connectionname = HttpReqParser.connectionname
+    ifnonematchname = HttpReqParser.ifnonematchname
+    ifmodifiedsincename = HttpReqParser.ifmodifiedsincename
+    acceptencodingname = HttpReqParser.acceptencodingname
+    methodname = HttpReqParser.methodname
+    rangename = HttpReqParser.rangename
+    ifrangename = HttpReqParser.ifrangename
+    headersname = HttpReqParser.headersname
+    contentlengthname = HttpReqParser.contentlengthname
+
+    def process_request(self, raw_req, keep_alive=False, tls=False):
+        code = -1
+        http_version = self.default_http_ver
+        payload = ""
+        content_type = None
+        resource = None
+        extra_fields = []
+        start = perf_counter_ns()
+        located = None
+        method = path = agent = referer = None
+
+        try:
+            parsed_data = HttpReqParser.parse(raw_req)
+            http_version = parsed_data[self.httpvername]
+            path = parsed_data[self.pathname]
+            host = parsed_data[self.hostname]
+            accept = parsed_data[self.acceptname]
+            connection = parsed_data[self.connectionname]
+            if_none_match = parsed_data[self.ifnonematchname]
+            if_modified_since = parsed_data[self.ifmodifiedsincename]
+            accept_encoding = parsed_data[self.acceptencodingname]
+            method = parsed_data[self.methodname]
+            range_spec = parsed_data[self.rangename]
+            if_range = parsed_data[self.ifrangename]
+            agent = parsed_data[self.agentname]
+            referer = parsed_data[self.headersname].get("referer")
+
+        except HTTPReqParserException as e:
+            code = self.mapExceptionToCode(e)
+            # The rest of the buffer cannot be trusted after a
+            # malformed request, so stop reading from this connection
+            keep_alive = False
+            parsed = perf_counter_ns()
+
+        else:
+            parsed = perf_counter_ns()
+            keep_alive = keep_alive and self.wants_keep_alive(
+                http_version,
+                connection
+            )
+            if parsed_data[self.contentlengthname]:
+                # The unread body would be parsed as the next
+                # request, so the connection ends with this one
+                keep_alive = False
+
+            handler = self.routes.get(path.partition("?")[0])
+            if handler is not None:
+                response = handler(parsed_data)
+                return self.process_generated(
+                    response,
+                    parsed_data,
+                    start,
+                    parsed,
+                    None,
+                    keep_alive
+                )
+
+            if self.virtual_hosts is None:
+                root, cache, index = self.basepath, self.file_cache, self.path_index
+            else:
+                vhost = self.virtual_hosts.lookup(host)
+                root, cache, index = vhost.root, vhost.file_cache, vhost.path_index
+
+            code, payload, resource = ResourceLocator.find(
+                path,
+                root,
+                cache,
+                index,
+                # Range requests never need the whole file in
+                # memory. HEAD loads the body like GET does, as
+                # its Content-Encoding, ETag and Content-Length
+                # depend on compressing it
+                read_body=range_spec is None,
+                # Ranges of a mapped file are zero-copy slices
+                store=self.mmap_store
+            )
+            located = perf_counter_ns()
+            if resource is not None:
+                content_type = resource.filetype
+
+            if code == 404 and self.autoindex is not None:
+                # Directories without an index file
+                response = self.autoindex.respond(path, root, index)
+                if response is not None:
+                    return self.process_generated(
+                        response,
+                        parsed_data,
+                        start,
+                        parsed,
+                        located,
+                        keep_alive
+                    )
+
+        # if code is 301, payload contains corrected path
+        if code == 301:
+            corrected_path = self.get_base_url(host, tls) + payload
+            payload = ""
+            location = self.create_field("Location", corrected_path)
+            extra_fields.append(location)
+
+        # check for accepted content-type
+        if content_type is not None:
+            mime_type, content_type = self.mime_registry.get(content_type)
+            if not accepts(accept, mime_type):
+                code = 406
+                payload = b""
+
+        if code == 200:
+            ranges = None
+            if range_spec is not None and self.if_range_matches(resource, if_range):
+                ranges = parse_ranges(range_spec, resource.size)
+
+            etag = resource.etag
+            if self.compressor is not None and self.compressor.is_compressible(resource):
+                # The body depends on Accept-Encoding whether or not
+                # this particular response ends up compressed
+                extra_fields.append(self.create_field("Vary", "Accept-Encoding"))
+                encoding = choose_encoding(accept_encoding)
+
+                # Byte ranges always refer to the identity body
+                if encoding is not None and ranges is None:
+                    variant = self.compressor.get_variant(resource, payload, encoding)
+                    if variant is not None:
+                        payload = variant
+                        # Each encoding is a different representation
+                        # and needs its own strong validator
+                        etag = f'{resource.etag[:-1]}-{encoding}"'
+                        extra_fields.append(
+                            self.create_field("Content-Encoding", encoding)
+                        )
+
+            extra_fields.append(self.create_field("Accept-Ranges", "bytes"))
+            extra_fields += self.validator_fields(path, resource, etag)
+            if self.is_not_modified(
+                resource,
+                etag,
+                if_none_match,
+                if_modified_since
+            ):
+                code = 304
+
+            elif ranges == []:
+                code = 416
+                extra_fields.append(self.create_field(
+                    "Content-Range",
+                    f"bytes */{resource.size}"
+                ))
+
+            elif len(ranges or ()) == 1:
+                code = 206
+                first, last = ranges[0]
+                payload = slice_body(payload, first, last)
+                extra_fields.append(self.create_field(
+                    "Content-Range",
+                    content_range(first, last, resource.size)
+                ))
+
+            elif ranges:
+                code = 206
+                content_type, payload = multipart_body(
+                    payload,
+                    ranges,
+                    content_type,
+                    resource.size
+                )
+
+        if code != 200 and code != 206:
+            # An error occurred, Not 200 OK, Empty payload
+            res = self.builder.build(
+                http_version,
+                code,
+                keep_alive,
+                fields=extra_fields
+            )
+            payload = b""
+
+        else:
+            # 200 OK, payload is Not empty
+            res = self.builder.build(
+                http_version,
+                code,
+                keep_alive,
+                content_type,
+                self.get_length(payload),
+                extra_fields
+            )
+            if method == "HEAD":
+                payload = b""
+
+        if self.metrics is not None:
+            self.metrics.observe_request(code, start, parsed, located)
+        if self.profiler is not None:
+            # Read by the engine right after this call returns
+            self.marks = (parsed, located)
+
+        # payload is bytes, a memoryview of a mapped file, a
+        # FileBody the caller streams after sending the header
+        # bytes, or a list of them. Routes return a
+        # StreamingResponse instead. summary describes the
+        # exchange for the access log
+        summary = (method, path, http_version, code, agent, referer)
+        return res, payload, keep_alive, summary
+
+    @classmethod
+    def add_route(cls, path, handler):
+        cls.routes[path] = handler
+
+    @classmethod
+    def metrics_route(cls, parsed_data):
+        body = cls.metrics.render(
+            cls.file_cache,
+            cls.compressor,
+            cls.access_log,
+            cls.admission,
+            cls.mmap_store,
+            cls.autoindex
+        )
+        return StreamingResponse([body], PROMETHEUS_TYPE, content_length=len(body))
+
+    @classmethod
+    def profile_route(cls, parsed_data):
+        # Collapsed stacks sampled so far, ?view=cprofile for the
+        # functions sampled requests spent their time in
+        query = parse_qs(parsed_data[cls.pathname].partition("?")[2], keep_blank_values=True)
+        if query.get("view") == ["cprofile"]:
+            body = cls.profiler.report()
+        elif cls.profiler.sampler is not None:
+            body = cls.profiler.sampler.collapsed("reset" in query)
+        else:
+            body = "stack sampling is off\n"
+
+        body = body.encode()
+        return StreamingResponse([body], content_length=len(body))
+
+    def process_generated(self, response, parsed_data, start, parsed, located,
+        keep_alive):
+        # Route and directory listing responses skip negotiation
+        http_version = parsed_data[self.httpvername]
+        method = parsed_data[self.methodname]
+        if self.metrics is not None:
+            self.metrics.observe_request(response.code, start, parsed, located)
+        if self.profiler is not None:
+            self.marks = (parsed, located)
+
+        res, payload, keep_alive = self.process_stream(
+            response,
+            http_version,
+            method,
+            keep_alive
+        )
+        summary = (
+            method,
+            parsed_data[self.pathname],
+            http_version,
+            response.code,
+            parsed_data[self.agentname],
+            parsed_data[self.headersname].get("referer")
+        )
+        return res, payload, keep_alive, summary
+
+    def process_stream(self, response, http_version, method, keep_alive):
+        if response.content_length is None:
+            if http_version == "HTTP/1.1":
+                response.chunked = True
+            else:
+                # Without chunked coding only closing the
+                # connection can mark the end of the body
+                keep_alive = False
+
+        res = self.builder.build_stream(
+            http_version,
+            response.code,
+            keep_alive,
+            response.content_type,
+            response.content_length,
+            response.chunked,
+            response.fields
+        )
+
+        if method == "HEAD":
+            response.close()
+            return res, b"", keep_alive
+
+        return res, response, keep_alive
+
+    def process_error(self, error, http_version=None):
+        # Used when no request could be parsed at all; the
+        # connection is always closed afterwards
+        code = self.mapExceptionToCode(error)
+        if self.metrics is not None:
+            self.metrics.count_response(code)
+
+        http_version = http_version or self.default_http_ver
+        res = self.builder.build(http_version, code, False)
+        summary = (None, None, http_version, code, None, None)
+        return res, b"", False, summary
+
+    def process_rejection(self, code, retry_after, keep_alive=False):
+        # Answers without parsing the request, so rejecting stays
+        # cheaper than serving
+        if self.metrics is not None:
+            self.metrics.count_response(code)
+
+        res = self.builder.build(
+            self.default_http_ver,
+            code,
+            keep_alive,
+            fields=[self.create_field("Retry-After", retry_after)]
+        )
+        summary = (None, None, self.default_http_ver, code, None, None)
+        return res, b"", keep_alive, summary
+
+    def get_base_url(self, host, tls=False):
+        if host is not None and HOST_PATTERN.fullmatch(host.strip()):
+            scheme = "https" if tls else "http"
+            return f"{scheme}://{host.strip()}"
+
+        return self.baseurl
+
+    def get_length(self, payload):
+        if isinstance(payload, list):
+            return sum(len(part) for part in payload)
+
+        return len(payload)
+
+    def if_range_matches(self, resource, if_range):
+        if if_range is None:
+            return True
+
+        # Either a strong ETag or the exact Last-Modified date
+        if if_range.startswith('"'):
+            return if_range == resource.etag
+
+        return if_range == resource.last_modified
+
+    def wants_keep_alive(self, http_version, connection):
+        tokens = []
+        if connection is not None:
+            tokens = [t.strip().lower() for t in connection.split(",")]
+
+        if "close" in tokens:
+            return False
+
+        # HTTP/1.1 connections are persistent by default,
+        # HTTP/1.0 ones only when the client asks for it
+        if http_version == "HTTP/1.0":
+            return "keep-alive" in tokens
+
+        return True
+
+    def validator_fields(self, path, resource, etag):
+        fields = [
+            self.create_field("ETag", etag),
+            self.create_field("Last-Modified", resource.last_modified)
+        ]
+
+        max_age = self.get_max_age(path, resource)
+        if max_age is not None:
+            fields.append(self.create_field("Cache-Control", f"max-age={max_age}"))
+
+        return fields
+
+    def get_max_age(self, path, resource):
+        for rule, max_age in self.cache_control_rules:
+            if rule.startswith("."):
+                if rule[1:] == resource.filetype:
+                    return max_age
+
+            elif path.startswith(rule):
+                return max_age
+
+        return None
+
+    def is_not_modified(self, resource, etag, if_none_match, if_modified_since):
+        # If-None-Match takes precedence over If-Modified-Since
+        if if_none_match is not None:
+            if if_none_match.strip() == "*":
+                return True
+
+            # GET uses the weak comparison, so W/ prefixes are ignored
+            for tag in if_none_match.split(","):
+                if tag.strip().removeprefix("W/") == etag:
+                    return True
+
+            return False
+
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+
+            return resource.mtime_ns // 10**9 <= since.timestamp()
+
+        return False
+
+    def mapExceptionToCode(self, error):
+        return self.error_codes.get(type(error), 400)
+
+    def create_field(self, field_name, field_value):
+        return f"{field_name}: {field_value}\r\n".encode()
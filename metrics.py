@@ -0,0 +1,186 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from bisect import bisect_left
+from time import perf_counter_ns
+
+# Upper bounds of the latency buckets in nanoseconds: 1, 2 and 5
+# per decade from 1us to 10s, so relative error stays bounded
+# at every scale like an HDR histogram but recording is a
+# bisect over 22 ints
+BUCKET_BOUNDS = [
+    mantissa * 10**exponent
+    for exponent in range(3, 10)
+    for mantissa in (1, 2, 5)
+] + [10**10]
+
+PHASES = ("parse", "locate", "negotiate", "send", "total")
+
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class Histogram:
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        # One slot per bound plus the +Inf overflow; counts are
+        # per bucket and only made cumulative when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.total_ns = 0
+
+    def observe(self, value_ns):
+        self.counts[bisect_left(self.bounds, value_ns)] += 1
+        self.total_ns += value_ns
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound / 1e9:g}"}} {cumulative}')
+
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total_ns / 1e9:.9f}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+# Counters and latency histograms for one server process. Worker
+# processes each keep their own, so /metrics reports on whichever
+# process answered it: one prefork worker's share of the traffic,
+# or with --mode fork only the connection asking, as each is
+# handled by a fresh child of a parent that counts nothing
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.bytes_sent = 0
+        self.connections_total = 0
+        self.active_connections = 0
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections_total += 1
+            self.active_connections += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.active_connections -= 1
+
+    def count_response(self, code):
+        with self.lock:
+            self.responses[code] = self.responses.get(code, 0) + 1
+
+    def observe_request(self, code, start, parsed, located):
+        # Timestamps are perf_counter_ns values taken by
+        # HttpResponder; located is None when no file was looked up
+        now = perf_counter_ns()
+        with self.lock:
+            self.responses[code] = self.responses.get(code, 0) + 1
+            self.phases["parse"].observe(parsed - start)
+            if located is not None:
+                self.phases["locate"].observe(located - parsed)
+                self.phases["negotiate"].observe(now - located)
+
+    def observe_send(self, start, sending, sent):
+        now = perf_counter_ns()
+        with self.lock:
+            self.bytes_sent += sent
+            self.phases["send"].observe(now - sending)
+            self.phases["total"].observe(now - start)
+
+    def render(self, file_cache=None, compressor=None, access_log=None,
+        admission=None, mmap_store=None, autoindex=None):
+        with self.lock:
+            lines = [
+                "# HELP http_responses_total Responses sent, by status code.",
+                "# TYPE http_responses_total counter",
+            ]
+            for code, count in sorted(self.responses.items()):
+                lines.append(f'http_responses_total{{code="{code}"}} {count}')
+
+            lines += [
+                "# HELP http_response_bytes_total Bytes written to clients.",
+                "# TYPE http_response_bytes_total counter",
+                f"http_response_bytes_total {self.bytes_sent}",
+                "# HELP http_connections_total Connections accepted.",
+                "# TYPE http_connections_total counter",
+                f"http_connections_total {self.connections_total}",
+                "# HELP http_connections_active Connections currently open.",
+                "# TYPE http_connections_active gauge",
+                f"http_connections_active {self.active_connections}",
+                "# HELP http_request_phase_seconds Time spent in each phase "
+                "of a request.",
+                "# TYPE http_request_phase_seconds histogram",
+            ]
+            for phase, histogram in self.phases.items():
+                lines += histogram.render(
+                    "http_request_phase_seconds",
+                    f'phase="{phase}"'
+                )
+
+        caches = (
+            ("file_cache", file_cache),
+            ("compression_cache", compressor),
+            ("mmap_store", mmap_store),
+            ("autoindex_cache", autoindex),
+        )
+        for name, cache in caches:
+            if cache is not None:
+                lines += self.render_cache(name, cache.stats())
+
+        if access_log is not None:
+            stats = access_log.stats()
+            lines += [
+                "# TYPE access_log_written_total counter",
+                f"access_log_written_total {stats['written']}",
+                "# TYPE access_log_dropped_total counter",
+                f"access_log_dropped_total {stats['dropped']}",
+                "# TYPE access_log_queued gauge",
+                f"access_log_queued {stats['queued']}",
+            ]
+
+        if admission is not None:
+            for key, value in admission.stats().items():
+                lines += [
+                    f"# TYPE admission_{key} gauge",
+                    f"admission_{key} {value}",
+                ]
+
+        return ("\n".join(lines) + "\n").encode()
+
+    def render_cache(self, name, stats):
+        lookups = stats["hits"] + stats["misses"]
+        lines = []
+        for key in ("hits", "misses", "evictions"):
+            lines += [
+                f"# TYPE {name}_{key}_total counter",
+                f"{name}_{key}_total {stats[key]}",
+            ]
+
+        lines += [
+            f"# TYPE {name}_hit_ratio gauge",
+            f"{name}_hit_ratio {stats['hits'] / lookups if lookups else 0:g}",
+            f"# TYPE {name}_entries gauge",
+            f"{name}_entries {stats['entries']}",
+        ]
+        # Caches bounded by entry count do not track bytes
+        if "bytes" in stats:
+            lines += [
+                f"# TYPE {name}_bytes gauge",
+                f"{name}_bytes {stats['bytes']}",
+            ]
+        return lines
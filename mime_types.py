@@ -0,0 +1,103 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mimetypes
+from functools import lru_cache
+
+DEFAULT_TYPE = "application/octet-stream"
+
+# Non-text types that are still text and need a charset
+TEXTUAL_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+}
+
+@lru_cache(maxsize=64)
+def parse_accept(accept):
+    # "text/html;q=0.9, */*;q=0.1" -> {("text", "html"): 0.9, ("*", "*"): 0.1}
+    ranges = {}
+    for item in accept.split(","):
+        media_range, *params = item.split(";")
+        main_type, slash, sub_type = media_range.strip().lower().partition("/")
+        if not slash or not main_type or not sub_type:
+            # Malformed ranges are ignored rather than rejected
+            continue
+
+        qvalue = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+
+        ranges[(main_type, sub_type)] = qvalue
+
+    return ranges
+
+@lru_cache(maxsize=512)
+def accepts(accept, mime_type):
+    # Clients send only a handful of distinct Accept values, so
+    # after warm-up this is answered from the memo
+    if not accept:
+        return True
+
+    ranges = parse_accept(accept)
+    main_type, _, sub_type = mime_type.partition("/")
+
+    # The most specific matching range decides
+    for key in ((main_type, sub_type), (main_type, "*"), ("*", "*")):
+        if key in ranges:
+            return ranges[key] > 0
+
+    return False
+
+class MimeRegistry:
+
+    def __init__(self, charset="utf-8", config_files=()):
+        self.charset = charset
+        # Starts from Python's built-in table only, so the result
+        # does not depend on the host's /etc/mime.types
+        self.mimetypes = mimetypes.MimeTypes()
+        for config_file in config_files:
+            # mime.types format: "type/subtype ext1 ext2 ..."
+            self.mimetypes.read(config_file)
+
+        # extension -> (mime type, Content-Type header value)
+        self.content_types = {}
+        for ext, mime_type in self.mimetypes.types_map[True].items():
+            self.content_types[ext[1:].lower()] = (
+                mime_type,
+                self.make_content_type(mime_type)
+            )
+
+        self.default = (DEFAULT_TYPE, DEFAULT_TYPE)
+
+    def make_content_type(self, mime_type):
+        if mime_type.startswith("text/") or mime_type in TEXTUAL_TYPES:
+            return f"{mime_type}; charset={self.charset}"
+
+        return mime_type
+
+    def add_type(self, ext, mime_type):
+        self.content_types[ext.lstrip(".").lower()] = (
+            mime_type,
+            self.make_content_type(mime_type)
+        )
+
+    def get(self, filetype):
+        return self.content_types.get(filetype.lower(), self.default)
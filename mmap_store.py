@@ -0,0 +1,91 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mmap
+import os
+from file_cache import LruCache
+
+# Mapped parts at least this long are written to the socket
+# on their own rather than copied behind the response head
+SEND_DIRECT_BYTES = 16 * 1024
+
+class Mapping:
+    __slots__ = ("view", "size", "mtime_ns")
+
+    def __init__(self, view, size, mtime_ns):
+        self.view = view
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+# Read-only mappings of large files, handed out as memoryviews.
+# The pages belong to the kernel's page cache, so every worker
+# process serving a file shares one copy of it instead of each
+# holding the bytes on its heap.
+#
+# A mapping is released by reference counting: the store drops
+# its reference when the file changes or the mapping is evicted,
+# and the region is unmapped once the last response slicing it
+# has been sent. Files should be replaced by rename, as truncating
+# a mapped file under a reader raises SIGBUS
+class MmapStore:
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, min_size=64 * 1024):
+        # Total size of the files kept mapped
+        self.max_bytes = max_bytes
+        # Smaller files are cheaper to read into the file cache
+        self.min_size = min_size
+
+        # path -> Mapping. Dropping one only drops the store's
+        # reference: in-flight responses keep their own references
+        # to the memoryview
+        self.mappings = LruCache(max_bytes, lambda mapping: mapping.size)
+
+    def wants(self, size):
+        return 0 < size and self.min_size <= size <= self.max_bytes
+
+    def get(self, path, size, mtime_ns):
+        # Returns a memoryview of the whole file, mapping it if the
+        # stored mapping is missing or of an older version. None
+        # when the file on disk no longer matches size and mtime_ns
+        mapping = self.mappings.get(path)
+        if mapping is not None:
+            if mapping.size == size and mapping.mtime_ns == mtime_ns:
+                self.mappings.hit()
+                return mapping.view
+
+            self.mappings.pop(path)
+
+        self.mappings.miss()
+
+        try:
+            with open(path, "rb") as file_descr:
+                stat = os.fstat(file_descr.fileno())
+                if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                    return None
+
+                # The mapping outlives the descriptor
+                view = memoryview(
+                    mmap.mmap(file_descr.fileno(), size, access=mmap.ACCESS_READ)
+                )
+        except (OSError, ValueError):
+            return None
+
+        self.mappings.put(path, Mapping(view, size, mtime_ns))
+        return view
+
+    def clear(self):
+        self.mappings.clear()
+
+    def stats(self):
+        return self.mappings.stats()
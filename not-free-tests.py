@@ -16,12 +16,71 @@
 # run: python not-free-tests.py
 
 from urllib import request
+from http import client
 import unittest
+import gzip
+import json
 import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
 
 BASEURL = "http://127.0.0.1:8080"
+# Port of the servers started with non-default options
+SPARE_PORT = 8089
 
 class TestYourWebserver(unittest.TestCase):
+    def raw_exchange(self, data, port=8080):
+        # Everything the server sends back before it closes
+        # the connection or stays quiet for a second
+        sock = socket.create_connection(("127.0.0.1", port), timeout=3)
+        sock.sendall(data)
+        sock.settimeout(1)
+        received = b""
+        try:
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                received += chunk
+        except (socket.timeout, ConnectionResetError):
+            pass
+        sock.close()
+        return received
+
+    def start_server(self, *options, env=None):
+        # Runs server.py with options, and env added to the
+        # environment, on SPARE_PORT until the test ends
+        server = subprocess.Popen(
+            [sys.executable, "server.py", "--listen", "127.0.0.1:%d" % SPARE_PORT, *options],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={**os.environ, **(env or {})},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        self.addCleanup(server.wait)
+        self.addCleanup(server.terminate)
+        for _ in range(50):
+            try:
+                socket.create_connection(("127.0.0.1", SPARE_PORT), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.fail("The server on port %d did not start!" % SPARE_PORT)
+
+    def make_root(self, files):
+        # A temporary document root holding files, a dict of
+        # name -> bytes, removed when the test ends
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        for name, body in files.items():
+            with open(os.path.join(root.name, name), "wb") as file_descr:
+                file_descr.write(body)
+        return root.name
+
     def setUp(self,baseurl=BASEURL):
         """do nothing"""
         self.baseurl = baseurl
@@ -63,6 +122,14 @@ class TestYourWebserver(unittest.TestCase):
         else:
             self.assertTrue( False, "Another Error was thrown!")
 
+    def test_nul_byte(self):
+        for path in ["/%00", "/deep/%00.html"]:
+            try:
+                request.urlopen(self.baseurl + path, None, 3)
+                self.assertTrue( False, "Should have thrown an HTTP Error for %s!" % path)
+            except request.HTTPError as e:
+                self.assertTrue( e.getcode()  == 404 , ("404 Not FOUND! %d" % e.getcode()))
+
     def test_css(self):
         url = self.baseurl + "/base.css"
         req = request.urlopen(url, None, 3)
@@ -129,5 +196,392 @@ class TestYourWebserver(unittest.TestCase):
         else:
             self.assertTrue( False, "Another Error was thrown!")
 
+    def test_keep_alive(self):
+        conn = client.HTTPConnection("127.0.0.1", 8080, timeout=3)
+        for path in ["/", "/base.css", "/do-not-implement-this-page-it-is-not-found"]:
+            conn.request("GET", path)
+            req = conn.getresponse()
+            req.read()
+            self.assertTrue( not req.will_close, "Connection closed after %s" % path)
+        conn.close()
+
+    def test_idle_keep_alive_does_not_block(self):
+        idle = client.HTTPConnection("127.0.0.1", 8080, timeout=3)
+        idle.request("GET", "/")
+        idle.getresponse().read()
+        # idle stays open without sending anything
+        started = time.monotonic()
+        req = request.urlopen(self.baseurl + "/base.css", None, 3)
+        waited = time.monotonic() - started
+        idle.close()
+        self.assertTrue( req.getcode()  == 200 , "200 OK Not FOUND!")
+        self.assertTrue( waited < 1, "Waited %.2fs behind an idle connection!" % waited)
+
+    def test_not_modified(self):
+        url = self.baseurl + "/base.css"
+        req = request.urlopen(url, None, 3)
+        etag = req.info().get("ETag")
+        self.assertTrue( etag is not None, "No ETag for /base.css!")
+        cond = request.Request(url=url, headers={"If-None-Match": etag})
+        try:
+            req = request.urlopen(cond, None, 3)
+            self.assertTrue( False, "Should have answered 304 for a matching ETag!")
+        except request.HTTPError as e:
+            self.assertTrue( e.getcode()  == 304 , ("304 Not FOUND! %d" % e.getcode()))
+
+    def test_head_and_range(self):
+        url = self.baseurl + "/base.css"
+        req = request.urlopen(request.Request(url=url, method="HEAD"), None, 3)
+        self.assertTrue( req.getcode()  == 200 , "200 OK Not FOUND for HEAD!")
+        self.assertTrue( req.read() == b"", "HEAD must not send a body!")
+        length = int(req.info().get("Content-Length"))
+        req = request.urlopen(request.Request(url=url, headers={"Range": "bytes=0-1"}), None, 3)
+        self.assertTrue( req.getcode()  == 206 , ("206 Not FOUND! %d" % req.getcode()))
+        self.assertTrue( req.info().get("Content-Range") == "bytes 0-1/%d" % length, "Bad Content-Range!")
+        self.assertTrue( len(req.read()) == 2, "Range should be 2 bytes!")
+
+    def test_compressed_head(self):
+        conn = client.HTTPConnection("127.0.0.1", 8080, timeout=3)
+        heads = []
+        for method in ["HEAD", "GET"]:
+            conn.request(method, "/deep/index.html", headers={"Accept-Encoding": "gzip"})
+            req = conn.getresponse()
+            req.read()
+            heads.append([req.getheader(name) for name in ("Content-Encoding", "Content-Length", "ETag")])
+        conn.close()
+        self.assertTrue( heads[0] == heads[1], "HEAD and GET headers differ! %s" % heads)
+
+    def test_metrics(self):
+        # Forked workers count separately, so both requests
+        # share one connection
+        conn = client.HTTPConnection("127.0.0.1", 8080, timeout=3)
+        conn.request("GET", "/")
+        conn.getresponse().read()
+        conn.request("GET", "/metrics")
+        req = conn.getresponse()
+        self.assertTrue( req.status  == 200 , "200 OK Not FOUND for /metrics!")
+        body = req.read().decode()
+        conn.close()
+        self.assertTrue( 'http_responses_total{code="200"}' in body, "No 200 counter!")
+        self.assertTrue( 'http_request_phase_seconds_count{phase="send"}' in body, "No send histogram!")
+
+    def test_metrics_after_range(self):
+        # Forked workers count separately, so both requests
+        # share one connection
+        conn = client.HTTPConnection("127.0.0.1", 8080, timeout=3)
+        conn.request("GET", "/base.css", headers={"Range": "bytes=0-1"})
+        conn.getresponse().read()
+        conn.request("GET", "/metrics")
+        body = conn.getresponse().read().decode()
+        conn.close()
+        for line in body.splitlines():
+            if line.startswith('http_request_phase_seconds_sum{phase="parse"}'):
+                self.assertTrue( float(line.split()[1]) < 60, "Parse time sum is off: %s" % line)
+                break
+        else:
+            self.assertTrue( False, "No parse time sum!")
+
+    def test_request_body_not_pipelined(self):
+        smuggled = b"GET /do-not-implement-this-page-it-is-not-found HTTP/1.1\r\nHost: x\r\n\r\n"
+        head = b"GET /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: %d\r\n\r\n"
+        received = self.raw_exchange(head % len(smuggled) + smuggled)
+        self.assertTrue( received.startswith(b"HTTP/1.1 200"), "200 OK Not FOUND for a GET with a body!")
+        self.assertTrue( b"404" not in received, "The body was parsed as a request!")
+
+    def test_transfer_encoding_refused(self):
+        received = self.raw_exchange(
+            b"GET /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"5\r\nhello\r\n0\r\n\r\n"
+        )
+        self.assertTrue( received.startswith(b"HTTP/1.1 400"), "400 Not FOUND for a chunked body!")
+        self.assertTrue( received.count(b"HTTP/1.1") == 1, "The chunked body was parsed as a request!")
+
+    def test_too_many_headers(self):
+        fields = b"".join(b"X-Field-%d: 1\r\n" % i for i in range(101))
+        received = self.raw_exchange(b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n" + fields + b"\r\n")
+        self.assertTrue( received.startswith(b"HTTP/1.1 400"), "400 Not FOUND for 102 header fields!")
+
+    def test_line_too_long(self):
+        received = self.raw_exchange(
+            b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\nX-Long: " + b"a" * 9000 + b"\r\n\r\n"
+        )
+        self.assertTrue( received.startswith(b"HTTP/1.1 400"), "400 Not FOUND for a 9000 byte line!")
+
+    def test_head_too_large(self):
+        fields = b"".join(b"X-Long-%d: %s\r\n" % (i, b"a" * 8000) for i in range(3))
+        received = self.raw_exchange(b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n" + fields + b"\r\n")
+        self.assertTrue( received.startswith(b"HTTP/1.1 431"), "431 Not FOUND for a 24000 byte head!")
+
+    def test_duplicate_host(self):
+        received = self.raw_exchange(b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\nHost: example.com\r\n\r\n")
+        self.assertTrue( received.startswith(b"HTTP/1.1 400"), "400 Not FOUND for two Host fields!")
+
+    def test_space_before_colon(self):
+        received = self.raw_exchange(b"GET / HTTP/1.1\r\nHost : 127.0.0.1\r\n\r\n")
+        self.assertTrue( received.startswith(b"HTTP/1.1 400"), "400 Not FOUND for 'Host :'!")
+
+    def test_malformed_fields(self):
+        for field in [b"X-A: b\nc", b"X-A: b\x00c", b"X-A: b\r\n folded", b"Foo Bar: x"]:
+            received = self.raw_exchange(b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n" + field + b"\r\n\r\n")
+            self.assertTrue( received.startswith(b"HTTP/1.1 400"), "400 Not FOUND for %r!" % field)
+
+    def test_header_names_any_case(self):
+        received = self.raw_exchange(b"GET / HTTP/1.1\r\nhost: 127.0.0.1\r\nConnection: close\r\n\r\n")
+        self.assertTrue( received.startswith(b"HTTP/1.1 200"), "200 OK Not FOUND for 'host:'!")
+        req = request.urlopen(self.baseurl + "/base.css", None, 3)
+        etag = req.info().get("ETag")
+        received = self.raw_exchange(
+            b"GET /base.css HTTP/1.1\r\nHOST: 127.0.0.1\r\niF-nOnE-mAtCh: %s\r\n"
+            b"CONNECTION: close\r\n\r\n" % etag.encode()
+        )
+        self.assertTrue( received.startswith(b"HTTP/1.1 304"), "304 Not FOUND for a mixed case If-None-Match!")
+
+    def test_multipart_range(self):
+        url = self.baseurl + "/base.css"
+        req = request.urlopen(request.Request(url=url, headers={"Range": "bytes=0-1,4-5"}), None, 3)
+        self.assertTrue( req.getcode()  == 206 , ("206 Not FOUND! %d" % req.getcode()))
+        content_type = req.info().get("Content-Type")
+        self.assertTrue( content_type.startswith("multipart/byteranges; boundary="), "Not multipart!")
+        body = req.read()
+        boundary = content_type.partition("boundary=")[2].encode()
+        self.assertTrue( body.count(b"--" + boundary) == 3, "Expected two parts and a closing boundary!")
+        self.assertTrue( b"Content-Range: bytes 0-1/" in body and b"Content-Range: bytes 4-5/" in body, "Bad part ranges!")
+
+    def test_range_not_satisfiable(self):
+        url = self.baseurl + "/base.css"
+        length = len(request.urlopen(url, None, 3).read())
+        try:
+            request.urlopen(request.Request(url=url, headers={"Range": "bytes=100000-"}), None, 3)
+            self.assertTrue( False, "Should have answered 416 for a range past the end!")
+        except request.HTTPError as e:
+            self.assertTrue( e.getcode()  == 416 , ("416 Not FOUND! %d" % e.getcode()))
+            self.assertTrue( e.headers.get("Content-Range") == "bytes */%d" % length, "Bad Content-Range!")
+
+    def test_request_timeout(self):
+        self.start_server("--request-timeout", "0.5")
+        received = self.raw_exchange(b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n", SPARE_PORT)
+        self.assertTrue( received.startswith(b"HTTP/1.1 408"), "408 Not FOUND for an unfinished head!")
+
+    def test_rate_limit(self):
+        self.start_server("--rate-limit", "0.1", "--rate-burst", "1")
+        conn = client.HTTPConnection("127.0.0.1", SPARE_PORT, timeout=3)
+        conn.request("GET", "/base.css")
+        req = conn.getresponse()
+        req.read()
+        self.assertTrue( req.status  == 200 , "200 OK Not FOUND for the first request!")
+        conn.request("GET", "/base.css")
+        req = conn.getresponse()
+        req.read()
+        conn.close()
+        self.assertTrue( req.status  == 429 , ("429 Not FOUND! %d" % req.status))
+        self.assertTrue( int(req.getheader("Retry-After")) > 0, "No Retry-After with 429!")
+
+    def test_max_connections(self):
+        self.start_server("--mode", "thread", "--max-connections", "1", "--retry-after", "7")
+        # Holds the only connection the server accepts, once the
+        # one start_server probed with has been closed
+        for _ in range(20):
+            held = client.HTTPConnection("127.0.0.1", SPARE_PORT, timeout=3)
+            held.request("GET", "/base.css")
+            req = held.getresponse()
+            req.read()
+            if req.status == 200:
+                break
+            held.close()
+            time.sleep(0.1)
+        self.addCleanup(held.close)
+        received = self.raw_exchange(b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n", SPARE_PORT)
+        self.assertTrue( received.startswith(b"HTTP/1.1 503"), "503 Not FOUND over --max-connections!")
+        self.assertTrue( b"\r\nRetry-After: 7\r\n" in received, "No Retry-After with 503!")
+
+    def test_path_index(self):
+        # Pre-forked workers must see new files too
+        self.start_server("--mode", "prefork", "--workers", "2", "--index", "--index-poll", "0.2")
+        base = "http://127.0.0.1:%d" % SPARE_PORT
+        req = request.urlopen(base + "/deep/", None, 3)
+        self.assertTrue( req.getcode()  == 200 , "200 OK Not FOUND for /deep/!")
+        received = self.raw_exchange(b"GET /deep HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n", SPARE_PORT)
+        self.assertTrue( received.startswith(b"HTTP/1.1 301"), "301 Not FOUND for /deep!")
+        try:
+            request.urlopen(base + "/index-poll.txt", None, 3)
+            self.assertTrue( False, "Should have thrown an HTTP Error!")
+        except request.HTTPError as e:
+            self.assertTrue( e.getcode()  == 404 , ("404 Not FOUND! %d" % e.getcode()))
+
+        with open("www/index-poll.txt", "w") as file_descr:
+            file_descr.write("new\n")
+        self.addCleanup(os.remove, "www/index-poll.txt")
+        time.sleep(1)
+        for _ in range(4):
+            # Each connection may land on a different worker
+            req = request.urlopen(base + "/index-poll.txt", None, 3)
+            self.assertTrue( req.getcode()  == 200 , "200 OK Not FOUND for a new file!")
+
+    def test_access_log_line_breaks(self):
+        log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(log_dir.cleanup)
+        log_path = os.path.join(log_dir.name, "access.log")
+        self.start_server("--access-log", log_path)
+        self.raw_exchange(
+            b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n"
+            b"User-Agent: evil\n10.0.0.9 - - [01/Jan/2021:00:00:00 +0000] \"GET /admin HTTP/1.1\" 200 1\r\n\r\n",
+            SPARE_PORT
+        )
+        time.sleep(0.6)
+        with open(log_path) as file_descr:
+            lines = file_descr.read().splitlines()
+        self.assertTrue( len(lines) == 1, "A header forged log lines: %s" % lines)
+
+    def test_virtual_hosts(self):
+        exact = self.make_root({"site.txt": b"exact"})
+        wildcard = self.make_root({"site.txt": b"wildcard"})
+        default = self.make_root({"site.txt": b"default"})
+        self.start_server(
+            "--vhost", "a.test=" + exact,
+            "--vhost", "*.wild.test=" + wildcard,
+            "--vhost", "c.test=" + default,
+            "--default-host", "c.test"
+        )
+        for host, expected in [(b"a.test", b"exact"), (b"A.TEST:8089", b"exact"),
+            (b"x.wild.test", b"wildcard"), (b"x.y.wild.test", b"wildcard"),
+            (b"wild.test", b"default"), (b"unknown.test", b"default")]:
+            received = self.raw_exchange(
+                b"GET /site.txt HTTP/1.1\r\nHost: " + host + b"\r\nConnection: close\r\n\r\n",
+                SPARE_PORT
+            )
+            self.assertTrue( received.startswith(b"HTTP/1.1 200"), "Host %s not served!" % host)
+            self.assertTrue( received.endswith(b"\r\n\r\n" + expected),
+                "Host %s served from the wrong root: %s" % (host, received))
+
+    def test_virtual_hosts_fall_back_to_root(self):
+        exact = self.make_root({"site.txt": b"exact"})
+        self.start_server("--vhost", "a.test=" + exact)
+        received = self.raw_exchange(
+            b"GET /site.txt HTTP/1.1\r\nHost: unknown.test\r\nConnection: close\r\n\r\n",
+            SPARE_PORT
+        )
+        self.assertTrue( received.startswith(b"HTTP/1.1 404"), "Unknown Host not served from --root!")
+        received = self.raw_exchange(
+            b"GET /index.html HTTP/1.1\r\nHost: unknown.test\r\nConnection: close\r\n\r\n",
+            SPARE_PORT
+        )
+        self.assertTrue( received.startswith(b"HTTP/1.1 200"), "Unknown Host not served from --root!")
+
+    def test_autoindex(self):
+        root = self.make_root({"a.txt": b"aaa", "b<i>.txt": b"b", "c.txt": b"cc"})
+        os.mkdir(os.path.join(root, "sub"))
+        self.start_server("--autoindex", "--autoindex-page-size", "2", "--root", root)
+        conn = client.HTTPConnection("127.0.0.1", SPARE_PORT, timeout=3)
+        self.addCleanup(conn.close)
+
+        conn.request("GET", "/")
+        req = conn.getresponse()
+        html = req.read().decode("utf-8")
+        self.assertTrue( req.status == 200, "No listing without an index.html!")
+        self.assertTrue( req.getheader("Content-Type").startswith("text/html"), "Listing is not HTML!")
+        self.assertTrue( "4 entries, page 1 of 2" in html, "Wrong listing summary: %s" % html)
+        self.assertTrue( 'href="sub/"' in html and 'href="a.txt"' in html, "Missing entries: %s" % html)
+        self.assertTrue( "b<i>" not in html, "Names are not escaped: %s" % html)
+        self.assertTrue( "page=2" in html, "No link to the next page: %s" % html)
+
+        conn.request("GET", "/?format=json&page=2")
+        req = conn.getresponse()
+        listing = json.loads(req.read())
+        self.assertTrue( req.getheader("Content-Type") == "application/json", "Listing is not JSON!")
+        self.assertTrue( listing["page"] == 2 and listing["pages"] == 2 and listing["total"] == 4,
+            "Wrong JSON pagination: %s" % listing)
+        self.assertTrue( [entry["name"] for entry in listing["entries"]] == ["b<i>.txt", "c.txt"],
+            "Wrong second page: %s" % listing)
+
+        conn.request("GET", "/?format=json&sort=size&order=desc&page=2")
+        req = conn.getresponse()
+        listing = json.loads(req.read())
+        # The directory comes first, then files largest first
+        self.assertTrue( [entry["name"] for entry in listing["entries"]] == ["c.txt", "b<i>.txt"],
+            "Wrong order by size: %s" % listing)
+        self.assertTrue( listing["sort"] == "size" and listing["order"] == "desc",
+            "Wrong JSON sort: %s" % listing)
+
+        conn.request("GET", "/missing/")
+        req = conn.getresponse()
+        req.read()
+        self.assertTrue( req.status == 404, "Listing for a missing directory!")
+
+    def test_compression(self):
+        text = b"All work and no play makes Jack a dull boy.\n" * 40
+        root = self.make_root({
+            "page.txt": text,
+            "small.txt": b"tiny",
+            "sibling.txt": text,
+            # Differs from sibling.txt so it can be told apart
+            # from a body compressed on the fly
+            "sibling.txt.gz": gzip.compress(b"from the sibling"),
+        })
+        sibling_time = os.stat(os.path.join(root, "sibling.txt")).st_mtime
+        os.utime(os.path.join(root, "sibling.txt.gz"), (sibling_time + 10, sibling_time + 10))
+        self.start_server("--root", root)
+        conn = client.HTTPConnection("127.0.0.1", SPARE_PORT, timeout=3)
+        self.addCleanup(conn.close)
+
+        def get(path, accept_encoding=None):
+            headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+            conn.request("GET", path, headers=headers)
+            req = conn.getresponse()
+            return req, req.read()
+
+        for accept_encoding in [None, "identity", "gzip;q=0", "br"]:
+            req, body = get("/page.txt", accept_encoding)
+            self.assertTrue( req.getheader("Content-Encoding") is None,
+                "Compressed for Accept-Encoding: %s" % accept_encoding)
+            self.assertTrue( req.getheader("Vary") == "Accept-Encoding", "No Vary on a compressible file!")
+            self.assertTrue( body == text, "Identity body changed!")
+
+        req, body = get("/page.txt", "deflate;q=0.5, gzip")
+        self.assertTrue( req.getheader("Content-Encoding") == "gzip", "Not gzipped when preferred!")
+        self.assertTrue( req.getheader("Vary") == "Accept-Encoding", "No Vary on a gzipped body!")
+        self.assertTrue( len(body) < len(text) and gzip.decompress(body) == text, "Bad gzip body!")
+
+        req, body = get("/page.txt", "deflate")
+        self.assertTrue( req.getheader("Content-Encoding") == "deflate", "Not deflated when asked!")
+        self.assertTrue( zlib.decompress(body) == text, "Bad deflate body!")
+
+        req, body = get("/sibling.txt", "gzip")
+        self.assertTrue( req.getheader("Content-Encoding") == "gzip", "Sibling not gzipped!")
+        self.assertTrue( gzip.decompress(body) == b"from the sibling", "The .gz sibling was not served!")
+
+        req, body = get("/small.txt", "gzip")
+        self.assertTrue( req.getheader("Content-Encoding") is None, "Compressed a tiny body!")
+        self.assertTrue( req.getheader("Vary") is None, "Vary on a body that is never compressed!")
+
+    def test_config_precedence(self):
+        file_root = self.make_root({"file.txt": b"file"})
+        env_root = self.make_root({"env.txt": b"env"})
+        config_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(config_dir.cleanup)
+        config_path = os.path.join(config_dir.name, "server.toml")
+        with open(config_path, "w") as file_descr:
+            file_descr.write(
+                "[server]\nroot = %s\nautoindex = true\nmetrics-path = \"/file-metrics\"\n"
+                % json.dumps(file_root)
+            )
+        # The file beats the defaults, the environment beats
+        # the file and the command line beats the environment
+        self.start_server(
+            "--config", config_path, "--metrics-path", "/cli-metrics",
+            env={"WEBSERVER_ROOT": env_root, "WEBSERVER_METRICS_PATH": "/env-metrics"}
+        )
+        conn = client.HTTPConnection("127.0.0.1", SPARE_PORT, timeout=3)
+        self.addCleanup(conn.close)
+        codes = {}
+        for path in ["/", "/file.txt", "/env.txt", "/file-metrics", "/env-metrics", "/cli-metrics"]:
+            conn.request("GET", path)
+            req = conn.getresponse()
+            req.read()
+            codes[path] = req.status
+        self.assertTrue( codes == {
+            "/": 200, "/file.txt": 404, "/env.txt": 200,
+            "/file-metrics": 404, "/env-metrics": 404, "/cli-metrics": 200,
+        }, "Settings applied in the wrong order: %s" % codes)
+
 if __name__ == '__main__':
     unittest.main()
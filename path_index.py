@@ -0,0 +1,175 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import posixpath
+import threading
+from os.path import join, realpath, relpath, splitext
+from urllib.parse import unquote
+
+class IndexEntry:
+    __slots__ = ("path", "size", "mtime_ns", "filetype", "is_dir", "has_index")
+
+    def __init__(self, path, size, mtime_ns, filetype, is_dir, has_index=False):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.filetype = filetype
+        self.is_dir = is_dir
+        # Directories only: whether an index file is present
+        self.has_index = has_index
+
+# Snapshot of every file and directory under a document root,
+# keyed by normalized URL path, so routing a request (200, 301
+# or 404) is a dict lookup instead of open() and its errors
+class PathIndex:
+
+    def __init__(self, root, index_f="index.html"):
+        self.root = root
+        self.index_f = index_f
+        self.entries = {}
+        # Directory path -> st_mtime_ns, polled to notice changes
+        self.dir_mtimes = {}
+        self.lock = threading.Lock()
+        self.build()
+
+    @staticmethod
+    def normalize(path):
+        # "/a/./b/../c" -> "/a/c"; ".." can never climb above "/",
+        # so escaping the root just misses the index
+        return "/" + posixpath.normpath(unquote(path)).lstrip("/")
+
+    def lookup(self, path):
+        return self.entries.get(self.normalize(path))
+
+    def build(self):
+        # Requests keep using the old snapshot until the swap; the
+        # lock only stops polling and a reload from scanning twice
+        with self.lock:
+            self.entries, self.dir_mtimes = self.scan()
+
+    def scan(self):
+        entries = {}
+        dir_mtimes = {}
+        real_root = realpath(self.root)
+        # Walk path -> (st_dev, st_ino) of every directory above it,
+        # so a symlink back up the tree is not followed forever
+        ancestors = {}
+
+        for dir_path, dir_names, file_names in os.walk(self.root, followlinks=True):
+            rel_dir = relpath(dir_path, self.root)
+            url_dir = "/" if rel_dir == "." else "/" + rel_dir.replace(os.sep, "/")
+
+            try:
+                stat = os.stat(dir_path)
+            except OSError:
+                continue
+
+            dir_mtimes[dir_path] = stat.st_mtime_ns
+            chain = ancestors.pop(dir_path, frozenset()) | {(stat.st_dev, stat.st_ino)}
+            entries[url_dir] = IndexEntry(
+                dir_path,
+                0,
+                stat.st_mtime_ns,
+                None,
+                True,
+                self.index_f in file_names
+            )
+
+            prefix = url_dir.rstrip("/") + "/"
+            followed = []
+            for name in dir_names:
+                full_path = join(dir_path, name)
+                if os.path.islink(full_path) and not self.can_follow(full_path, chain, real_root):
+                    # Listed so /name still redirects to /name/, but
+                    # nothing under it is served
+                    entries[prefix + name] = IndexEntry(full_path, 0, 0, None, True)
+                    continue
+
+                followed.append(name)
+                ancestors[full_path] = chain
+
+            dir_names[:] = followed
+
+            for name in file_names:
+                full_path = join(dir_path, name)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    # Dangling symlink
+                    continue
+
+                entries[prefix + name] = IndexEntry(
+                    full_path,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    splitext(name)[1][1:],
+                    False
+                )
+
+        return entries, dir_mtimes
+
+    def can_follow(self, link_path, chain, real_root):
+        # Symlinked directories are indexed when they resolve inside
+        # the root and are not one of the directories above them
+        try:
+            stat = os.stat(link_path)
+        except OSError:
+            return False
+
+        if (stat.st_dev, stat.st_ino) in chain:
+            return False
+
+        target = realpath(link_path)
+        return target == real_root or target.startswith(real_root + os.sep)
+
+    def is_stale(self):
+        # Adding, removing or renaming an entry changes its
+        # directory's mtime, so only directories are polled
+        for dir_path, mtime_ns in self.dir_mtimes.items():
+            try:
+                if os.stat(dir_path).st_mtime_ns != mtime_ns:
+                    return True
+            except OSError:
+                return True
+
+        return False
+
+    def refresh(self):
+        if self.is_stale():
+            self.build()
+
+    def start_polling(self, interval=2.0):
+        self.poll_interval = interval
+        self.start_poller()
+
+        # Threads do not survive fork, so pre-forked workers poll
+        # their own copy of the index
+        os.register_at_fork(after_in_child=self.after_fork)
+        return self.stop
+
+    def start_poller(self):
+        self.stop = threading.Event()
+        threading.Thread(target=self.poll, daemon=True).start()
+
+    def poll(self):
+        while not self.stop.wait(self.poll_interval):
+            self.refresh()
+
+    def after_fork(self):
+        self.lock = threading.Lock()
+        self.start_poller()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,194 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from itertools import count
+from os.path import basename, join
+from time import gmtime, strftime, time
+
+PHASES = ("parse", "locate", "negotiate", "send", "total")
+
+# Logs the phase breakdown of requests slower than threshold_ms,
+# one line each. Slow requests are rare, so it writes inline
+class SlowRequestLog:
+
+    def __init__(self, threshold_ms, path="-"):
+        self.threshold_ns = threshold_ms * 10**6
+        self.path = path
+        self.file = sys.stderr if path == "-" else open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def __call__(self, summary, phases):
+        if phases["total"] < self.threshold_ns:
+            return
+
+        method, path, version, status = summary[:4]
+        breakdown = " ".join(
+            f"{phase}={phases[phase] / 1e6:.3f}ms" for phase in PHASES
+        )
+        line = (
+            f'[{strftime("%d/%b/%Y:%H:%M:%S +0000", gmtime(time()))}] '
+            f'slow "{method or "-"} {path or "-"} {version}" {status} {breakdown}\n'
+        )
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+# Samples the stack of every thread at a fixed interval and folds
+# them into collapsed stacks ("a;b;c count" lines), the input of
+# flamegraph.pl and speedscope. Wall clock, so time spent waiting
+# on sockets and locks shows up too
+class StackSampler:
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.start()
+
+        # Threads do not survive fork
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def after_fork(self):
+        self.stacks = Counter()
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.start()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+
+                stack = ";".join(reversed(names))
+                with self.lock:
+                    self.stacks[stack] += 1
+
+    def collapsed(self, reset=False):
+        with self.lock:
+            stacks = self.stacks
+            if reset:
+                self.stacks = Counter()
+
+        return "".join(f"{stack} {n}\n" for stack, n in stacks.most_common())
+
+# Opt-in profiling of the request path. Engines call it only when
+# HttpResponder.profiler is set, so a server without one pays a
+# single attribute test per request
+class Profiler:
+
+    def __init__(self, sample_every=0, stack_interval=0, dump_dir="."):
+        # cProfile one request in sample_every, 0 never
+        self.sample_every = sample_every
+        self.dump_dir = dump_dir
+        # Callables taking (summary, phases), phases mapping each
+        # name in PHASES to nanoseconds
+        self.hooks = []
+
+        self.requests = count(1)
+        # pstats.Stats merging every sampled request
+        self.stats = None
+        self.samples = 0
+        self.lock = threading.Lock()
+
+        self.sampler = None
+        if stack_interval > 0:
+            self.sampler = StackSampler(stack_interval)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def start_sample(self):
+        # An enabled cProfile.Profile for a sampled request, else None
+        if not self.sample_every or next(self.requests) % self.sample_every:
+            return None
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active; skip this sample
+            return None
+
+        return profile
+
+    def finish_sample(self, profile):
+        profile.disable()
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.samples += 1
+
+    def observe(self, summary, start, parsed, located, sending, sent):
+        # perf_counter_ns timestamps; located is None when no
+        # file was looked up
+        if not self.hooks:
+            return
+
+        looked_up = located or parsed
+        phases = {
+            "parse": parsed - start,
+            "locate": looked_up - parsed,
+            "negotiate": sending - looked_up,
+            "send": sent - sending,
+            "total": sent - start,
+        }
+        for hook in self.hooks:
+            hook(summary, phases)
+
+    def report(self, limit=40):
+        # The functions sampled requests spent the most time in
+        with self.lock:
+            if self.stats is None:
+                return "no requests sampled\n"
+
+            out = io.StringIO()
+            self.stats.stream = out
+            out.write(f"{self.samples} sampled requests\n")
+            self.stats.sort_stats("cumulative").print_stats(limit)
+
+        return out.getvalue()
+
+    def dump(self):
+        # Writes the collapsed stacks and the merged cProfile stats
+        # (readable with pstats or snakeviz) to dump_dir
+        prefix = join(self.dump_dir, f"profile-{os.getpid()}-{int(time())}")
+        if self.sampler is not None:
+            with open(prefix + ".stacks", "w", encoding="utf-8") as file_descr:
+                file_descr.write(self.sampler.collapsed())
+
+        with self.lock:
+            if self.stats is not None:
+                self.stats.dump_stats(prefix + ".pstats")
@@ -0,0 +1,87 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+from http_req_parser import RequestHeaderFieldsTooLarge, RequestTimeout
+from time import monotonic
+
+# Reads request heads from a blocking socket into one fixed
+# buffer, so a connection never holds more than max_header_size
+# bytes and each byte is scanned for the terminator only once
+class RequestReader:
+    terminator = b"\r\n\r\n"
+
+    def __init__(self, sock, max_header_size=16384, idle_timeout=5,
+        request_timeout=10):
+        self.sock = sock
+        self.buffer = bytearray(max_header_size)
+        self.view = memoryview(self.buffer)
+        # Bytes of self.buffer holding received data
+        self.filled = 0
+        # Offset where the next terminator search starts
+        self.scanned = 0
+        # Seconds to wait for the first byte of a request
+        self.idle_timeout = idle_timeout
+        # Seconds allowed between the first byte and the end of the head
+        self.request_timeout = request_timeout
+
+    # Returns the next request head as bytes, or None when the peer
+    # closed the connection or stayed idle past idle_timeout
+    def read_request(self):
+        deadline = None
+        while True:
+            end = self.buffer.find(self.terminator, self.scanned, self.filled)
+            if end != -1:
+                return self.consume(end + len(self.terminator))
+
+            # Back up so a terminator split across two recvs is found
+            self.scanned = max(self.filled - len(self.terminator) + 1, 0)
+
+            if self.filled == len(self.buffer):
+                raise RequestHeaderFieldsTooLarge
+
+            if self.filled == 0:
+                timeout = self.idle_timeout
+            else:
+                if deadline is None:
+                    deadline = monotonic() + self.request_timeout
+
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    raise RequestTimeout
+
+            self.sock.settimeout(timeout)
+            try:
+                received = self.sock.recv_into(self.view[self.filled:])
+            except socket.timeout:
+                if self.filled == 0:
+                    return None
+
+                raise RequestTimeout
+
+            if received == 0:
+                # A half-sent request from a closed peer is dropped
+                return None
+
+            self.filled += received
+
+    def consume(self, end):
+        raw_req = bytes(self.view[:end])
+
+        # Pipelined bytes after this request move to the front
+        remaining = self.filled - end
+        self.buffer[:remaining] = self.buffer[end:self.filled]
+        self.filled = remaining
+        self.scanned = 0
+        return raw_req
@@ -15,49 +15,131 @@
 import os
 from os.path import *
 from urllib.parse import quote, unquote
+from file_cache import CacheEntry
+
+# Body of a file too large to hold in memory, sent
+# straight from the file with sendfile()
+class FileBody:
+    __slots__ = ("path", "offset", "count")
+
+    def __init__(self, path, offset, count):
+        self.path = path
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
 
 class ResourceLocator:
     index_f = "index.html"
+    # Files larger than this are streamed instead of read
+    # when there is no cache deciding what fits in memory
+    stream_threshold = 64 * 1024
+    # Document root -> its absolute path
+    abs_roots = {}
 
     @classmethod
     def get_filetype(cls, file_descr):
-        fname = file_descr.name
-        index = len(fname) - 1
-        while fname[index] != ".":
-            index -= 1
+        # "" for names without an extension
+        return splitext(file_descr.name)[1][1:]
+
+    @classmethod
+    def is_inside(cls, full_path, root):
+        abs_root = cls.abs_roots.get(root)
+        if abs_root is None:
+            abs_root = cls.abs_roots[root] = abspath(root)
 
-        return fname[index+1:]
+        # A plain substring test would let /www/../www-private
+        # through, so compare whole path components
+        abs_path = abspath(full_path)
+        return abs_path == abs_root or abs_path.startswith(abs_root + os.sep)
 
     @classmethod
-    def find(cls, path, root):
+    def find(cls, path, root, cache=None, index=None, read_body=True, store=None):
         if path[-1] == "/":
             path += cls.index_f
 
-        full_path = join(root + unquote(path))
-        # DEBUG CODE:
-        # Uncomment to print path information
-        # print("path", path)
-        # print("full path", full_path)
-        # print("root", root)
-        # print("abspath full_path", abspath(full_path))
-        # print("abspath root", abspath(root))
-        # print("root not in abspath full_path", root not in abspath(full_path))
-
-        if abspath(root) not in abspath(full_path):
-            return 404, "", None
+        if index is not None:
+            # Routing comes straight from the PathIndex, so 301s
+            # and 404s cost no syscalls
+            indexed = index.lookup(path)
+            if indexed is None:
+                return 404, "", None
+
+            if indexed.is_dir:
+                return 301, path + "/", None
+
+            full_path = indexed.path
+
+        else:
+            full_path = join(root + unquote(path))
+            # DEBUG CODE:
+            # Uncomment to print path information
+            # print("path", path)
+            # print("full path", full_path)
+            # print("root", root)
+            # print("abspath full_path", abspath(full_path))
+
+            if not cls.is_inside(full_path, root):
+                return 404, "", None
+
+        # Cached entries are returned without opening the file
+        cache_key = normpath(full_path)
+        if cache is not None:
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return 200, cls.get_body(entry, store), entry
+
+        stream_threshold = cls.stream_threshold
+        if cache is not None:
+            stream_threshold = cache.max_entry_bytes
 
         try:
-            with open(full_path, "r") as file_descr:
-                payload = file_descr.read()
-                return 200, payload, cls.get_filetype(file_descr)
+            with open(full_path, "rb") as file_descr:
+                stat = os.fstat(file_descr.fileno())
+                filetype = cls.get_filetype(file_descr)
+                payload = None
+                # Mapped files share the page cache across workers
+                # instead of being copied into each one's heap
+                mapped = store is not None and store.wants(stat.st_size)
+                if read_body and not mapped and stat.st_size <= stream_threshold:
+                    payload = file_descr.read()
 
         except IsADirectoryError:
             path += "/"
             return 301, path, None
 
-        except FileNotFoundError:
+        # ValueError: a NUL byte, from %00 in the URL
+        except (FileNotFoundError, NotADirectoryError, ValueError):
             return 404, "", None
 
+        entry = CacheEntry(
+            cache_key,
+            payload,
+            filetype,
+            stat.st_size,
+            stat.st_mtime_ns
+        )
+        # A metadata-only entry for a small file would stop
+        # later GETs from caching its body
+        if cache is not None and (payload is not None or mapped
+            or stat.st_size > stream_threshold):
+            cache.put(entry)
+
+        return 200, cls.get_body(entry, store), entry
+
+    @classmethod
+    def get_body(cls, entry, store=None):
+        if entry.body is not None:
+            return entry.body
+
+        if store is not None and store.wants(entry.size):
+            view = store.get(entry.path, entry.size, entry.mtime_ns)
+            if view is not None:
+                return view
+
+        return FileBody(entry.path, 0, entry.size)
+
 
 # DEBUG CODE:
 # Uncomment code and run "python resource_locator.py"
@@ -0,0 +1,134 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from email.utils import formatdate
+from time import time
+
+HTTP_VERSIONS = ("HTTP/1.1", "HTTP/1.0")
+
+STATUS_REASONS = {
+    200: "OK",
+    206: "Partial Content",
+    301: "Moved Permanently",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    406: "Not Acceptable",
+    408: "Request Timeout",
+    416: "Range Not Satisfiable",
+    429: "Too Many Requests",
+    431: "Request Header Fields Too Large",
+    503: "Service Unavailable",
+    505: "HTTP Version Not Supported",
+}
+
+class DateCache:
+
+    def __init__(self):
+        self.second = -1
+        self.field = b""
+
+    def get(self):
+        now = int(time())
+        if now != self.second:
+            # IMF-fixdate from RFC 7231, e.g.
+            # Date: Sun, 06 Nov 1994 08:49:37 GMT
+            self.field = b"Date: %s\r\n" % formatdate(now, usegmt=True).encode()
+            self.second = now
+
+        return self.field
+
+# Builds response heads out of byte strings prepared up front,
+# so most responses are a single join and empty ones (errors,
+# redirects) need no formatting at all
+class ResponseBuilder:
+
+    def __init__(self, keep_alive_timeout=5, max_keep_alive_requests=100):
+        self.date = DateCache()
+
+        self.status_lines = {}
+        for http_ver in HTTP_VERSIONS:
+            for code, reason in STATUS_REASONS.items():
+                self.status_lines[(http_ver, code)] = (
+                    f"{http_ver} {code} {reason}\r\n".encode()
+                )
+
+        self.connection_fields = {
+            True: (
+                b"Connection: keep-alive\r\n"
+                b"Keep-Alive: timeout=%s, max=%d\r\n"
+                % (f"{keep_alive_timeout:g}".encode(), max_keep_alive_requests)
+            ),
+            False: b"Connection: close\r\n",
+        }
+
+        # Every header of an empty response except Date, which
+        # is appended last. A 304 describes the cached body, so it
+        # must not claim a length of 0
+        self.empty_heads = {}
+        for (http_ver, code), status_line in self.status_lines.items():
+            for keep_alive, connection in self.connection_fields.items():
+                length = b"" if code == 304 else b"Content-Length: 0\r\n"
+                self.empty_heads[(http_ver, code, keep_alive)] = (
+                    status_line + length + connection
+                )
+
+        # Content-Type value -> header line
+        self.content_type_fields = {}
+
+    def get_content_type_field(self, content_type):
+        field = self.content_type_fields.get(content_type)
+        if field is None:
+            field = b"Content-Type: %s\r\n" % content_type.encode()
+            self.content_type_fields[content_type] = field
+
+        return field
+
+    def build(self, http_ver, code, keep_alive, content_type=None,
+        content_length=0, fields=()):
+        if content_type is None:
+            head = self.empty_heads[(http_ver, code, keep_alive)]
+        else:
+            head = b"".join((
+                self.status_lines[(http_ver, code)],
+                self.get_content_type_field(content_type),
+                b"Content-Length: %d\r\n" % content_length,
+                self.connection_fields[keep_alive]
+            ))
+
+        if not fields:
+            return head + self.date.get() + b"\r\n"
+
+        return b"".join((head, *fields, self.date.get(), b"\r\n"))
+
+    def build_stream(self, http_ver, code, keep_alive, content_type,
+        content_length=None, chunked=False, fields=()):
+        if content_length is not None:
+            length = b"Content-Length: %d\r\n" % content_length
+        elif chunked:
+            length = b"Transfer-Encoding: chunked\r\n"
+        else:
+            # HTTP/1.0: the body ends when the connection closes
+            length = b""
+
+        return b"".join((
+            self.status_lines[(http_ver, code)],
+            self.get_content_type_field(content_type),
+            length,
+            self.connection_fields[keep_alive],
+            *fields,
+            self.date.get(),
+            b"\r\n"
+        ))
@@ -1,6 +1,7 @@
 #!/bin/bash
 # Run the webserver, run the tests and kill the webserver!
-python3 server.py &
+# Extra arguments are passed to the server, e.g. --engine asyncio
+python3 server.py "$@" &
 ID=$!
 python3 freetests.py
 python3 not-free-tests.py
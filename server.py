@@ -1,5 +1,10 @@
 #  coding: utf-8 
+import argparse
+import os
+import signal
 import socketserver
+import ssl
+import threading
 
 # Copyright 2013 Abram Hindle, Eddie Antonio Santos, Olivier Vadiavaloo
 # 
@@ -26,171 +31,849 @@ import socketserver
 
 # try: curl -v -X GET http://127.0.0.1:8080/
 
-from http_req_parser import *
-from resource_locator import ResourceLocator
-from time import gmtime, strftime
-from os.path import join
-from urllib.parse import quote
-
-class MyWebServer(socketserver.BaseRequestHandler):
-
-    basepath = "www"
-    baseurl = "http://127.0.0.1:8080"
-    default_http_ver = "HTTP/1.1"
-    charset = "utf-8"
+from access_log import FORMATS, AccessLog
+from admission import Admission
+from async_server import serve_async
+from autoindex import Autoindex
+from compression import Compressor
+from config import ConfigError, format_url, load_config, parse_listen
+from file_cache import FileCache
+from handoff import adopt_listeners
+from http2 import h2
+from http_req_parser import HTTPReqParserException
+from http_responder import HttpResponder
+from mime_types import MimeRegistry
+from mmap_store import SEND_DIRECT_BYTES, MmapStore
+from path_index import PathIndex
+from profiling import Profiler, SlowRequestLog
+from request_reader import RequestReader
+from resource_locator import FileBody
+from response_builder import ResponseBuilder
+from server_modes import (
+    GracefulTCPServer, SocketOptions, exit_hooks, make_server, reload_hooks, serve
+)
+from streaming import LAST_CHUNK, StreamingResponse, iterate_sync
+from tls import make_tls_context
+from time import perf_counter_ns
+from virtual_hosts import VirtualHost, VirtualHosts
+
+class MyWebServer(HttpResponder, socketserver.BaseRequestHandler):
 
     def setup(self):
-        self.httpvername = HttpReqParser.httpvername
-        self.pathname = HttpReqParser.pathname
-        self.hostname = HttpReqParser.hostname
-        self.agentname = HttpReqParser.agentname
-        self.acceptname = HttpReqParser.acceptname
-    
-    def handle(self):
-        self.data = b""
-        while True:
-            self.data += self.request.recv(4096)
-            if self.data.find(b"\r\n\r\n") != -1:
-                break
+        self.admitted = False
+        self.reader = RequestReader(
+            self.request,
+            self.max_header_size,
+            self.keep_alive_timeout,
+            self.request_timeout
+        )
+        if self.metrics is not None:
+            self.metrics.connection_opened()
+
+    def finish(self):
+        if self.metrics is not None:
+            self.metrics.connection_closed()
+
+        if self.admitted:
+            self.admission.connection_closed(self.client_address[0])
 
-        code = -1
-        http_version = self.default_http_ver
-        payload = ""
-        content_type = None
-        extra_fields = []
-        
+    def handle(self):
         try:
-            parsed_data = HttpReqParser.parse(self.data)
-            http_version = parsed_data[self.httpvername]
-            path = parsed_data[self.pathname]
-            host = parsed_data[self.hostname]
-            accept = parsed_data[self.acceptname]
-            
-        except HTTPReqParserException as e:
-            code = self.mapExceptionToCode(e)
-
-        else:
-            code, payload, content_type = ResourceLocator.find(path, self.basepath)
-
-        # if code is 301, payload contains corrected path
-        if code == 301:
-            corrected_path = self.baseurl + payload
-            payload = ""
-            location = self.create_field("Location", corrected_path)
-            extra_fields.append(location)
-
-        # check for accepted content-type
-        if content_type is not None:
-            if content_type != "html" and content_type != "css":
-                content_type = "application/octet-stream"
-            else:
-                content_type = "text/" + content_type
-
-            content_type += f"; charset={self.charset}"
-
-            if accept is None:
-                accept = "*/*"
-            
-            elif content_type not in accept and "*/*" not in accept:
-                code = 406
-                payload = ""
-
-        if code != 200:
-            # An error occurred, Not 200 OK, Empty payload
-            res = self.template_res(False, extra_fields)
-            res = res.format(
-                http_ver=http_version,
-                status=self.get_status_str(code),
-                payload=payload
-            )
-
-        else:
-            # 200 OK, payload is Not empty
-            res = self.template_res(more=extra_fields)
-            res = res.format(
-                http_ver=http_version,
-                status=self.get_status_str(code),
-                content_type=content_type,
-                content_length=len(payload),
-                payload=payload
-            )
-
-        # DEBUG CODE:
-        # Uncomment to see request and response
-        # print("="*30)
-        # print(self.data)
-        # print("_"*40)
-        # print(res)
-        # print("="*30)
-
-        self.request.sendall(bytearray(res, "utf-8"))
-
-    def mapExceptionToCode(self, error):
-        if type(error) is MethodNotAllowed:
-            return 405
-
-        if type(error) is UnsupportedHTTPVer:
-            return 505
-
-        if type(error) is UnsupportedPath:
-            return 404
-
-        if type(error) is BadRequest:
-            return 400
-
-    def get_status_str(self, status_code):
-        if status_code == 200:
-            return "200 OK"
-        
-        if status_code == 406:
-            return "406 Not Acceptable"
-
-        if status_code == 301:
-            return "301 Moved Permanently"
-
-        if status_code == 404:
-            return "404 Not Found"
-
-        if status_code == 405:
-            return "405 Method Not Allowed"
-
-        if status_code == 400:
-            return "400 Bad Request"
+            self.serve_connection()
+        except (ConnectionError, TimeoutError, ssl.SSLError):
+            # The client went away or stopped reading mid-response
+            pass
+
+    def serve_connection(self):
+        requests_served = 0
+        keep_alive = True
+
+        self.tls = isinstance(self.request, ssl.SSLSocket)
+        if self.tls:
+            self.request.settimeout(self.request_timeout)
+            try:
+                self.request.do_handshake()
+            except (ssl.SSLError, OSError):
+                # Failed or abandoned handshakes, port scanners
+                return
+
+        ip = self.client_address[0]
+        if self.admission is not None:
+            if not self.admission.connection_opened(ip):
+                # Over the connection limits: answer at once
+                # instead of waiting for a request
+                head, body, _, summary = self.process_rejection(
+                    503,
+                    self.admission.retry_after
+                )
+                self.send_response(head, body)
+                self.log_access(summary, 0, 0)
+                return
+
+            self.admitted = True
+
+        # Serve requests on this connection until either side asks
+        # to close it, the idle timeout expires or the limit is hit
+        while keep_alive:
+            try:
+                raw_req = self.reader.read_request()
+
+            except HTTPReqParserException as e:
+                # Request too large or too slow, answer and hang up
+                head, body, keep_alive, summary = self.process_error(e)
+                sent = self.send_response(head, body)
+                self.log_access(summary, sent - len(head), 0)
+                break
 
-        if status_code == 505:
-            return "505 HTTP Version Not Supported"
+            except (ConnectionError, ssl.SSLError):
+                break
 
-    def create_field(self, field_name, field_value):
-        return field_name + ": " + field_value + "\r\n"
-    
-    def template_res(self, has_content_type=True, more=[]):
-        res = "{http_ver} {status}\r\n"
+            if raw_req is None:
+                # Peer closed the connection or stayed idle
+                break
 
-        formatted_gmtime = strftime("%a, %d %b %Y %H:%M:%S %p %Z", gmtime())
-        res += f"Date: {formatted_gmtime}\r\n"
-        
-        if has_content_type:
-            res += "Content-Type: {content_type}\r\n"
-            res += "Content-Length: {content_length}\r\n"
+            requests_served += 1
+            keep_alive = (
+                requests_served < self.max_keep_alive_requests
+                and not getattr(self.server, "draining", False)
+            )
+            if self.admission is not None:
+                rejection = self.admission.check_request(ip)
+                if rejection is not None:
+                    code, retry_after = rejection
+                    # Rate limited clients may keep their connection,
+                    # overload sheds it
+                    head, body, keep_alive, summary = self.process_rejection(
+                        code,
+                        retry_after,
+                        keep_alive and code == 429
+                    )
+                    self.send_response(head, body)
+                    self.log_access(summary, 0, 0)
+                    continue
+
+            profile = None
+            if self.profiler is not None:
+                profile = self.profiler.start_sample()
+
+            start = perf_counter_ns()
+            try:
+                head, body, keep_alive, summary = self.process_request(
+                    raw_req,
+                    keep_alive,
+                    self.tls
+                )
+                sending = perf_counter_ns()
+                sent = self.send_response(head, body)
+            finally:
+                if self.admission is not None:
+                    self.admission.request_finished((perf_counter_ns() - start) / 1e9)
+                if profile is not None:
+                    self.profiler.finish_sample(profile)
+
+            if self.metrics is not None:
+                self.metrics.observe_send(start, sending, sent)
+            if self.profiler is not None:
+                self.profiler.observe(summary, start, *self.marks, sending, perf_counter_ns())
+
+            self.log_access(summary, sent - len(head), perf_counter_ns() - start)
+
+    def log_access(self, summary, body_bytes, latency_ns):
+        if self.access_log is not None:
+            self.access_log.log(self.client_address[0], summary, body_bytes, latency_ns)
+
+    def send_response(self, head, body):
+        # The reader leaves whatever timeout its last recv needed
+        self.request.settimeout(self.request_timeout)
+        if isinstance(body, StreamingResponse):
+            return self.send_stream(head, body)
+
+        parts = body if isinstance(body, list) else [body]
+        sent = len(head)
+
+        # Byte strings are batched behind the head; a FileBody
+        # flushes them, then the kernel copies the file to the
+        # socket. socket.sendfile falls back to read/send where
+        # os.sendfile is unavailable
+        pending = head
+        for part in parts:
+            sent += len(part)
+            if isinstance(part, FileBody):
+                self.request.sendall(pending)
+                pending = b""
+                with open(part.path, "rb") as file_descr:
+                    self.request.sendfile(file_descr, part.offset, part.count)
+
+            elif isinstance(part, memoryview) and len(part) >= SEND_DIRECT_BYTES:
+                # Mapped pages are sent without a copy on the heap
+                self.request.sendall(pending)
+                pending = b""
+                self.request.sendall(part)
 
-        res += "Connection: close\r\n"
-        
-        for field in more:
-            res += field
-        
-        res += "\r\n"
+            else:
+                pending += part
+
+        if pending:
+            self.request.sendall(pending)
+
+        return sent
+
+    def send_stream(self, head, body):
+        # The head goes out before the first chunk is produced;
+        # sendall blocking on a slow client holds back the
+        # producer, so memory stays at one chunk
+        self.request.sendall(head)
+        sent = len(head)
+        for chunk in iterate_sync(body.chunks):
+            if chunk:
+                frame = body.frame(chunk)
+                self.request.sendall(frame)
+                sent += len(frame)
+
+        if body.chunked:
+            self.request.sendall(LAST_CHUNK)
+            sent += len(LAST_CHUNK)
+
+        return sent
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve files from a document root",
+        epilog="Every option can also be set in the --config file or as "
+            "an environment variable, e.g. WEBSERVER_KEEP_ALIVE_TIMEOUT=10; "
+            "the command line wins over the environment, which wins over "
+            "the file."
+    )
+    parser.add_argument(
+        "--config",
+        metavar="FILE",
+        help="TOML or INI ([server] section) file of settings named "
+            "like the options, e.g. keep-alive-timeout = 10"
+    )
+    parser.add_argument(
+        "--listen",
+        action="append",
+        metavar="ADDRESS",
+        help="host:port to listen on, [::1]:port for IPv6; repeat for "
+            "several listeners (default localhost:8080)"
+    )
+    parser.add_argument(
+        "--tls-listen",
+        action="append",
+        metavar="ADDRESS",
+        help="host:port serving HTTPS with --tls-cert and --tls-key"
+    )
+    parser.add_argument(
+        "--tls-cert",
+        metavar="FILE",
+        help="PEM certificate chain for --tls-listen"
+    )
+    parser.add_argument(
+        "--tls-key",
+        metavar="FILE",
+        help="PEM private key for --tls-listen"
+    )
+    parser.add_argument(
+        "--tls-tickets",
+        type=int,
+        default=2,
+        help="TLS 1.3 session tickets sent per handshake, 0 disables them"
+    )
+    parser.add_argument(
+        "--http2",
+        action="store_true",
+        help="offer HTTP/2 through ALPN on --tls-listen addresses "
+            "(asyncio engine, needs the h2 package)"
+    )
+    parser.add_argument(
+        "--root",
+        default=HttpResponder.basepath,
+        metavar="DIR",
+        help="document root to serve files from"
+    )
+    parser.add_argument(
+        "--vhost",
+        action="append",
+        default=[],
+        metavar="NAME=DIR",
+        help="serve Host NAME (or *.domain) from DIR; every site gets "
+            "its own --cache-size cache"
+    )
+    parser.add_argument(
+        "--default-host",
+        metavar="NAME",
+        help="--vhost serving unknown Host headers instead of --root"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["socketserver", "asyncio"],
+        default="socketserver",
+        help="blocking socketserver handler or asyncio event loop"
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["single", "thread", "fork", "prefork"],
+        default=None,
+        help="how connections are handled concurrently (default thread; "
+            "single serves one connection at a time, so an idle keep-alive "
+            "client holds up every other one)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="threads, processes or pre-forked workers to use"
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=128,
+        help="size of the listening socket's accept queue"
+    )
+    parser.add_argument(
+        "--reuse-port",
+        action="store_true",
+        help="set SO_REUSEPORT so several servers can share a port"
+    )
+    parser.add_argument(
+        "--no-delay",
+        action="store_true",
+        help="set TCP_NODELAY on connections"
+    )
+    parser.add_argument(
+        "--rcvbuf",
+        type=int,
+        default=0,
+        help="SO_RCVBUF in bytes, 0 keeps the system default"
+    )
+    parser.add_argument(
+        "--sndbuf",
+        type=int,
+        default=0,
+        help="SO_SNDBUF in bytes, 0 keeps the system default"
+    )
+    parser.add_argument(
+        "--keep-alive-timeout",
+        type=float,
+        default=HttpResponder.keep_alive_timeout,
+        help="idle seconds before a persistent connection is closed"
+    )
+    parser.add_argument(
+        "--max-keep-alive-requests",
+        type=int,
+        default=HttpResponder.max_keep_alive_requests,
+        help="requests served on one connection before closing it"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=HttpResponder.file_cache.max_bytes,
+        help="bytes of file bodies kept in memory, 0 disables the cache"
+    )
+    parser.add_argument(
+        "--mmap-size",
+        type=int,
+        default=0,
+        help="bytes of large files served from shared read-only mappings, "
+            "0 disables mapping"
+    )
+    parser.add_argument(
+        "--mmap-min-size",
+        type=int,
+        default=64 * 1024,
+        help="smallest file in bytes that is mapped instead of read"
+    )
+    parser.add_argument(
+        "--cache-control",
+        action="append",
+        default=[],
+        metavar="RULE=SECONDS",
+        help="max-age for a path prefix (/deep/=60) or extension (.css=3600)"
+    )
+    parser.add_argument(
+        "--no-compression",
+        action="store_true",
+        help="never send gzip or deflate encoded bodies"
+    )
+    parser.add_argument(
+        "--compress-min-size",
+        type=int,
+        default=HttpResponder.compressor.min_size,
+        help="smallest body in bytes that is compressed"
+    )
+    parser.add_argument(
+        "--max-header-size",
+        type=int,
+        default=HttpResponder.max_header_size,
+        help="largest request head in bytes, larger ones get 431"
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=HttpResponder.request_timeout,
+        help="seconds a client has to finish sending a request head"
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="index ./www at startup and route requests from memory"
+    )
+    parser.add_argument(
+        "--index-poll",
+        type=float,
+        default=2.0,
+        help="seconds between checks of ./www for changes, 0 disables "
+            "polling (SIGHUP always reloads the index)"
+    )
+    parser.add_argument(
+        "--autoindex",
+        action="store_true",
+        help="list directories that have no index.html instead of answering 404"
+    )
+    parser.add_argument(
+        "--autoindex-page-size",
+        type=int,
+        default=1000,
+        help="entries per page of a directory listing"
+    )
+    parser.add_argument(
+        "--metrics-path",
+        default="/metrics",
+        metavar="PATH",
+        help="URL path serving Prometheus metrics, empty to disable them; "
+            "with --mode prefork they cover the worker that answers, with "
+            "--mode fork only the requesting connection"
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=0,
+        help="open connections served at once, 0 for no limit"
+    )
+    parser.add_argument(
+        "--max-connections-per-ip",
+        type=int,
+        default=0,
+        help="open connections per client address, 0 for no limit"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=0.0,
+        help="requests per second per client address, 0 for no limit"
+    )
+    parser.add_argument(
+        "--rate-burst",
+        type=float,
+        default=None,
+        help="requests a client may send at once above --rate-limit"
+    )
+    parser.add_argument(
+        "--max-inflight",
+        type=int,
+        default=0,
+        help="requests processed at once before answering 503"
+    )
+    parser.add_argument(
+        "--shed-latency",
+        type=float,
+        default=0.0,
+        help="average request seconds above which requests get 503"
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=int,
+        default=1,
+        help="Retry-After seconds sent with 503 responses"
+    )
+    parser.add_argument(
+        "--access-log",
+        metavar="FILE",
+        help="write an access log to FILE, - for stdout"
+    )
+    parser.add_argument(
+        "--access-log-format",
+        choices=FORMATS,
+        default="combined",
+        help="Apache common or combined lines, or JSON objects"
+    )
+    parser.add_argument(
+        "--access-log-max-bytes",
+        type=int,
+        default=0,
+        help="rotate the access log at this size, 0 never rotates"
+    )
+    parser.add_argument(
+        "--access-log-backups",
+        type=int,
+        default=5,
+        help="rotated access logs to keep"
+    )
+    parser.add_argument(
+        "--access-log-sample",
+        type=float,
+        default=1.0,
+        help="fraction of 2xx responses to log, others are always logged"
+    )
+    parser.add_argument(
+        "--access-log-queue",
+        type=int,
+        default=65536,
+        help="records buffered for the writer before new ones are dropped"
+    )
+    parser.add_argument(
+        "--mime-types",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="mime.types style file overriding extension to type mappings"
+    )
+    parser.add_argument(
+        "--profile-sample",
+        type=int,
+        default=0,
+        metavar="N",
+        help="cProfile one request in N, 0 disables sampling"
+    )
+    parser.add_argument(
+        "--profile-stacks",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="interval between stack samples for flame graphs, 0 disables them"
+    )
+    parser.add_argument(
+        "--profile-path",
+        default="",
+        metavar="PATH",
+        help="URL path serving the collapsed stacks, ?view=cprofile for the "
+            "sampled requests' profile; empty disables it"
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=".",
+        metavar="DIR",
+        help="directory SIGUSR1 dumps the collapsed stacks and profile into"
+    )
+    parser.add_argument(
+        "--slow-request-ms",
+        type=float,
+        default=0,
+        help="log the phase timings of requests slower than this, 0 disables it"
+    )
+    parser.add_argument(
+        "--slow-request-log",
+        default="-",
+        metavar="FILE",
+        help="file the slow request log is appended to, - for stderr"
+    )
+    args = load_config(parser, argv)
+    validate_args(parser, args)
+    return args
+
+# Options that must be above zero, and ones that may also be zero
+POSITIVE_OPTIONS = (
+    "workers", "backlog", "keep_alive_timeout", "max_keep_alive_requests",
+    "max_header_size", "request_timeout", "retry_after", "access_log_queue",
+    "autoindex_page_size",
+)
+NON_NEGATIVE_OPTIONS = (
+    "rcvbuf", "sndbuf", "tls_tickets", "cache_size", "mmap_size", "mmap_min_size",
+    "compress_min_size", "index_poll",
+    "max_connections", "max_connections_per_ip", "rate_limit", "rate_burst",
+    "max_inflight", "shed_latency", "access_log_max_bytes",
+    "access_log_backups", "profile_sample", "profile_stacks", "slow_request_ms",
+)
+
+# Admission limits, which need one process to see every connection
+ADMISSION_OPTIONS = (
+    "max_connections", "max_connections_per_ip", "rate_limit",
+    "max_inflight", "shed_latency",
+)
+
+def validate_args(parser, args):
+    # Checked once at startup, so a bad setting stops the
+    # server before it binds instead of failing on a request
+    for name in POSITIVE_OPTIONS:
+        value = getattr(args, name)
+        if value is not None and value <= 0:
+            parser.error(f"--{name.replace('_', '-')} must be greater than 0")
+
+    for name in NON_NEGATIVE_OPTIONS:
+        value = getattr(args, name)
+        if value is not None and value < 0:
+            parser.error(f"--{name.replace('_', '-')} must not be negative")
+
+    if not args.listen and not args.tls_listen:
+        args.listen = ["localhost:8080"]
+
+    try:
+        args.listen = [parse_listen(address) for address in args.listen or ()]
+        args.tls_listen = [parse_listen(address, 8443) for address in args.tls_listen or ()]
+    except ConfigError as e:
+        parser.error(str(e))
+
+    addresses = args.listen + args.tls_listen
+    if len(set(addresses)) != len(addresses):
+        parser.error("--listen and --tls-listen addresses must be different")
+
+    if args.tls_listen:
+        if not args.tls_cert or not args.tls_key:
+            parser.error("--tls-listen needs --tls-cert and --tls-key")
 
-        res += "{payload}"
-        return res
+        try:
+            args.tls_context = make_tls_context(
+                args.tls_cert,
+                args.tls_key,
+                http2=args.http2,
+                tickets=args.tls_tickets
+            )
+        except (OSError, ssl.SSLError) as e:
+            parser.error(f"cannot load --tls-cert/--tls-key: {e}")
+
+    if args.http2:
+        if h2 is None:
+            parser.error("--http2 needs the h2 package")
+        if not args.tls_listen or args.engine != "asyncio":
+            parser.error("--http2 needs --tls-listen and --engine asyncio")
+
+    if not os.path.isdir(args.root):
+        parser.error(f"--root {args.root} is not a directory")
+
+    vhosts = {}
+    for vhost in args.vhost:
+        name, equals, root = vhost.partition("=")
+        name = name.strip().lower()
+        if not equals or not name or "*" in name.removeprefix("*."):
+            parser.error(f"--vhost expects NAME=DIR or *.DOMAIN=DIR, got {vhost}")
+        if name in vhosts:
+            parser.error(f"--vhost {name} is given twice")
+        if not os.path.isdir(root):
+            parser.error(f"--vhost {name}: {root} is not a directory")
+        vhosts[name] = root
+    args.vhost = list(vhosts.items())
+
+    if args.default_host is not None:
+        args.default_host = args.default_host.lower()
+        if args.default_host not in vhosts or args.default_host.startswith("*."):
+            parser.error("--default-host must name a --vhost without wildcards")
+
+    for path in args.mime_types:
+        if not os.path.isfile(path):
+            parser.error(f"--mime-types {path} does not exist")
+
+    if not 0 <= args.access_log_sample <= 1:
+        parser.error("--access-log-sample must be between 0 and 1")
+
+    if args.metrics_path and not args.metrics_path.startswith("/"):
+        parser.error("--metrics-path must start with /")
+
+    if args.profile_path and not args.profile_path.startswith("/"):
+        parser.error("--profile-path must start with /")
+
+    if not os.path.isdir(args.profile_dir):
+        parser.error(f"--profile-dir {args.profile_dir} is not a directory")
+
+    try:
+        args.cache_control = [
+            (rule, int(max_age))
+            for rule, max_age in (r.rsplit("=", 1) for r in args.cache_control)
+        ]
+    except ValueError:
+        parser.error("--cache-control expects RULE=SECONDS")
+
+    if args.mode is None:
+        args.mode = "thread" if args.engine == "socketserver" else "single"
+    elif args.engine == "asyncio" and args.mode != "single":
+        parser.error("--mode only applies to the socketserver engine")
+
+    if args.mode == "prefork" and len(addresses) > 1:
+        # Each master would reap the other's workers
+        parser.error("--mode prefork supports a single --listen address")
+
+    if args.mode == "fork":
+        # Each connection is served by a child forked with a copy
+        # of the parent's empty tables, so no limit would ever trip
+        for name in ADMISSION_OPTIONS:
+            if getattr(args, name):
+                parser.error(
+                    f"--{name.replace('_', '-')} cannot be used with --mode fork"
+                )
 
 
 if __name__ == "__main__":
-    HOST, PORT = "localhost", 8080
+    args = parse_args()
+
+    HttpResponder.basepath = args.root
+    if args.listen:
+        HttpResponder.baseurl = format_url(*args.listen[0])
+    else:
+        HttpResponder.baseurl = format_url(*args.tls_listen[0], scheme="https")
+
+    HttpResponder.keep_alive_timeout = args.keep_alive_timeout
+    HttpResponder.max_keep_alive_requests = args.max_keep_alive_requests
+    HttpResponder.builder = ResponseBuilder(
+        args.keep_alive_timeout,
+        args.max_keep_alive_requests
+    )
+    HttpResponder.max_header_size = args.max_header_size
+    HttpResponder.request_timeout = args.request_timeout
+    HttpResponder.cache_control_rules = args.cache_control
+    HttpResponder.mime_registry = MimeRegistry(
+        HttpResponder.charset,
+        args.mime_types
+    )
+    HttpResponder.compressor = (
+        None if args.no_compression
+        else Compressor(min_size=args.compress_min_size)
+    )
+    def make_file_cache():
+        return FileCache(max_bytes=args.cache_size) if args.cache_size > 0 else None
+
+    HttpResponder.file_cache = make_file_cache()
+    if args.mmap_size > 0:
+        # One store for every site, so the cap covers them all
+        HttpResponder.mmap_store = MmapStore(args.mmap_size, args.mmap_min_size)
+
+    if args.vhost:
+        virtual_hosts = VirtualHosts(
+            VirtualHost("", HttpResponder.basepath, HttpResponder.file_cache)
+        )
+        for name, root in args.vhost:
+            virtual_hosts.add(VirtualHost(name, root, make_file_cache()))
+
+        if args.default_host is not None:
+            virtual_hosts.default = virtual_hosts.exact[args.default_host]
+
+        HttpResponder.virtual_hosts = virtual_hosts
+
+    if any(getattr(args, name) for name in ADMISSION_OPTIONS):
+        HttpResponder.admission = Admission(
+            max_connections=args.max_connections,
+            max_connections_per_ip=args.max_connections_per_ip,
+            rate=args.rate_limit,
+            burst=args.rate_burst,
+            max_inflight=args.max_inflight,
+            shed_latency=args.shed_latency,
+            retry_after=args.retry_after
+        )
+
+    if args.access_log:
+        HttpResponder.access_log = AccessLog(
+            args.access_log,
+            args.access_log_format,
+            max_bytes=args.access_log_max_bytes,
+            backups=args.access_log_backups,
+            max_queue=args.access_log_queue,
+            sample_2xx=args.access_log_sample
+        )
+        exit_hooks.append(HttpResponder.access_log.flush)
+
+    if args.autoindex:
+        HttpResponder.autoindex = Autoindex(
+            args.autoindex_page_size,
+            scan_in_executor=args.engine == "asyncio"
+        )
+
+    if args.metrics_path:
+        HttpResponder.add_route(args.metrics_path, HttpResponder.metrics_route)
+    else:
+        HttpResponder.metrics = None
+
+    if (args.profile_sample or args.profile_stacks or args.profile_path
+        or args.slow_request_ms):
+        profiler = Profiler(args.profile_sample, args.profile_stacks, args.profile_dir)
+        if args.slow_request_ms:
+            profiler.add_hook(SlowRequestLog(args.slow_request_ms, args.slow_request_log))
+        if args.profile_path:
+            HttpResponder.add_route(args.profile_path, HttpResponder.profile_route)
+
+        # Every process dumps its own; signal the process group
+        # to capture all pre-forked workers
+        signal.signal(
+            signal.SIGUSR1,
+            lambda signum, frame: threading.Thread(
+                target=profiler.dump,
+                daemon=True
+            ).start()
+        )
+        HttpResponder.profiler = profiler
+
+    if args.index:
+        HttpResponder.path_index = PathIndex(HttpResponder.basepath)
+        indexes = [HttpResponder.path_index]
+        for vhost in HttpResponder.virtual_hosts or ():
+            if vhost.root == HttpResponder.basepath:
+                vhost.path_index = HttpResponder.path_index
+            else:
+                vhost.path_index = PathIndex(vhost.root)
+                indexes.append(vhost.path_index)
+
+        if args.index_poll > 0:
+            for index in indexes:
+                index.start_polling(args.index_poll)
+
+        def rebuild_indexes():
+            for index in indexes:
+                index.build()
+
+        reload_hooks.append(rebuild_indexes)
+
+    # SIGHUP also drops every cached body, so content replaced
+    # in place is picked up at once
+    caches = [
+        HttpResponder.file_cache,
+        HttpResponder.compressor,
+        HttpResponder.mmap_store,
+        HttpResponder.autoindex,
+    ]
+    caches += [vhost.file_cache for vhost in HttpResponder.virtual_hosts or ()]
+
+    def clear_caches():
+        for cache in caches:
+            if cache is not None:
+                cache.clear()
+
+    reload_hooks.append(clear_caches)
+
+    socket_options = SocketOptions(
+        reuse_port=args.reuse_port,
+        no_delay=args.no_delay,
+        rcvbuf=args.rcvbuf,
+        sndbuf=args.sndbuf
+    )
+
+    listeners = [(address, None) for address in args.listen]
+    listeners += [(address, args.tls_context) for address in args.tls_listen]
+
+    # Sockets handed over by the process this one replaces
+    # after a SIGUSR2 restart; unset on a normal start
+    adopt_listeners()
+
+    if args.engine == "asyncio":
+        serve_async(listeners, args.backlog, socket_options)
+
+    else:
+        # One server per listen address, localhost:8080 by default
+        GracefulTCPServer.socket_options = socket_options
+        servers = [
+            make_server(
+                args.mode,
+                address,
+                MyWebServer,
+                workers=args.workers,
+                backlog=args.backlog,
+                tls_context=tls_context
+            )
+            for address, tls_context in listeners
+        ]
 
-    socketserver.TCPServer.allow_reuse_address = True
-    # Create the server, binding to localhost on port 8080
-    server = socketserver.TCPServer((HOST, PORT), MyWebServer)
+        # Activate the servers; they keep running until you
+        # interrupt the program with Ctrl-C or send it SIGTERM.
+        # SIGHUP reloads the content, SIGUSR2 restarts the
+        # program without closing the listening sockets
+        serve(*servers)
 
-    # Activate the server; this will keep running until you
-    # interrupt the program with Ctrl-C
-    server.serve_forever()
+    if HttpResponder.access_log is not None:
+        HttpResponder.access_log.close()
@@ -0,0 +1,336 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import signal
+import socket
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from handoff import notify_ready, spawn_successor, take_listener
+
+# Called in forked children right before os._exit, which skips
+# atexit handlers and kills background threads
+exit_hooks = []
+
+def run_exit_hooks():
+    for hook in exit_hooks:
+        hook()
+
+# Called on SIGHUP to pick up new content: rebuilding path
+# indexes, emptying caches
+reload_hooks = []
+
+def run_reload_hooks():
+    for hook in reload_hooks:
+        hook()
+
+class SocketOptions:
+
+    def __init__(self, reuse_port=False, no_delay=False, rcvbuf=0, sndbuf=0):
+        # Lets several processes bind the same port, the kernel
+        # spreads connections between them
+        self.reuse_port = reuse_port
+        # Sends small responses at once instead of waiting
+        # for Nagle's algorithm
+        self.no_delay = no_delay
+        # Kernel buffer sizes in bytes, 0 keeps the system default
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+
+    def apply_listener(self, sock):
+        # Accepted sockets inherit the buffer sizes on Linux
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if self.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+
+    def apply_connection(self, sock):
+        if self.no_delay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+def address_family(server_address):
+    return socket.AF_INET6 if ":" in server_address[0] else socket.AF_INET
+
+def create_listener(server_address, backlog=128, options=None):
+    # Listening socket for engines that do not bind their own
+    sock = take_listener(server_address)
+    if sock is not None:
+        return sock
+
+    sock = socket.socket(address_family(server_address), socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        (options or SocketOptions()).apply_listener(sock)
+        sock.bind(server_address)
+        sock.listen(backlog)
+    except:
+        sock.close()
+        raise
+
+    return sock
+
+class GracefulTCPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    # Set once shutdown starts so handlers stop keeping
+    # connections alive and in-flight requests can drain
+    draining = False
+    socket_options = SocketOptions()
+    # ssl.SSLContext wrapping accepted connections, None for plain TCP
+    tls_context = None
+
+    def __init__(self, server_address, handler, backlog=128):
+        self.address_family = address_family(server_address)
+        super().__init__(server_address, handler, bind_and_activate=False)
+        self.request_queue_size = backlog
+        sock = take_listener(server_address)
+        if sock is not None:
+            # Bound and listening already, in the process this
+            # one replaces
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
+
+        else:
+            try:
+                self.server_bind()
+                self.server_activate()
+            except:
+                self.server_close()
+                raise
+
+        # Several processes may wake up for one connection; those
+        # losing the accept() race go back to polling instead of
+        # blocking, where they would not notice a shutdown
+        self.socket.setblocking(False)
+
+    def server_bind(self):
+        self.socket_options.apply_listener(self.socket)
+        super().server_bind()
+
+    def get_request(self):
+        request, client_address = super().get_request()
+        self.socket_options.apply_connection(request)
+        if self.tls_context is not None:
+            # The handshake happens in the handler, so a slow
+            # client never holds up the accept loop
+            request = self.tls_context.wrap_socket(
+                request,
+                server_side=True,
+                do_handshake_on_connect=False
+            )
+
+        return request, client_address
+
+    def shutdown(self):
+        self.draining = True
+        super().shutdown()
+
+    def reload(self):
+        # Off the main thread so serving never stalls
+        threading.Thread(target=run_reload_hooks, daemon=True).start()
+
+class ThreadPoolTCPServer(GracefulTCPServer):
+
+    def __init__(self, server_address, handler, workers=16, backlog=128):
+        super().__init__(server_address, handler, backlog)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # The accept loop blocks while every worker is busy, so
+        # extra connections wait in the kernel backlog instead
+        # of piling up in the executor queue
+        self.free_workers = threading.BoundedSemaphore(workers)
+
+    def process_request(self, request, client_address):
+        self.free_workers.acquire()
+        self.pool.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.free_workers.release()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+class ForkingPoolTCPServer(socketserver.ForkingMixIn, GracefulTCPServer):
+
+    def __init__(self, server_address, handler, workers=16, backlog=128):
+        super().__init__(server_address, handler, backlog)
+        # ForkingMixIn waits for a child to exit before
+        # forking past max_children
+        self.max_children = workers
+
+    def finish_request(self, request, client_address):
+        # Only runs in the child, which exits right after
+        try:
+            super().finish_request(request, client_address)
+        finally:
+            run_exit_hooks()
+
+class PreforkTCPServer(GracefulTCPServer):
+
+    def __init__(self, server_address, handler, workers=None, backlog=128):
+        super().__init__(server_address, handler, backlog)
+        self.workers = workers or os.cpu_count() or 1
+        self.worker_pids = set()
+        # Workers of older generations, finishing their requests
+        self.retired_pids = set()
+        self.poll_interval = 0.5
+        self.is_worker = False
+        self.stopping = False
+
+    def serve_forever(self, poll_interval=0.5):
+        if self.is_worker:
+            return super().serve_forever(poll_interval)
+
+        self.poll_interval = poll_interval
+        for _ in range(self.workers):
+            self.spawn_worker()
+
+        while self.worker_pids or self.retired_pids:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+
+            # Retired workers and a successor that failed to
+            # start are reaped without a replacement
+            self.retired_pids.discard(pid)
+            if pid in self.worker_pids:
+                self.worker_pids.discard(pid)
+                if not self.stopping:
+                    # Replace a worker that died unexpectedly
+                    self.spawn_worker()
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self.worker_pids.add(pid)
+            return
+
+        # Every worker accepts on the listening socket
+        # inherited from the parent, which alone reloads
+        # and restarts
+        self.is_worker = True
+        self.worker_pids = set()
+        self.retired_pids = set()
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+        status = 0
+        try:
+            self.serve_forever(self.poll_interval)
+        except BaseException:
+            self.handle_error(None, None)
+            status = 1
+        finally:
+            run_exit_hooks()
+            os._exit(status)
+
+    def reload(self):
+        if self.is_worker or self.stopping:
+            return
+
+        # Runs in the parent's signal handler: the new generation
+        # is forked after the reload, so it starts with fresh
+        # indexes and empty caches. The old one stops accepting
+        # and exits once its in-flight requests are answered; the
+        # listening socket is open the whole time
+        run_reload_hooks()
+        old_pids = self.worker_pids
+        self.worker_pids = set()
+        for _ in range(self.workers):
+            self.spawn_worker()
+
+        self.retired_pids |= old_pids
+        self.signal_workers(old_pids)
+
+    def shutdown(self):
+        if self.is_worker:
+            return super().shutdown()
+
+        self.stopping = True
+        self.signal_workers(self.worker_pids | self.retired_pids)
+
+    def signal_workers(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+def make_server(mode, server_address, handler, workers=None, backlog=128,
+    tls_context=None):
+    if mode == "single":
+        server = GracefulTCPServer(server_address, handler, backlog)
+    elif mode == "thread":
+        server = ThreadPoolTCPServer(server_address, handler, workers or 16, backlog)
+    elif mode == "fork":
+        server = ForkingPoolTCPServer(server_address, handler, workers or 16, backlog)
+    elif mode == "prefork":
+        server = PreforkTCPServer(server_address, handler, workers, backlog)
+    else:
+        raise ValueError(f"unknown server mode: {mode}")
+
+    server.tls_context = tls_context
+    return server
+
+def serve(*servers):
+    # shutdown() blocks until serve_forever returns, so it
+    # cannot be called from the thread running serve_forever.
+    # Each gets its own thread: in a pre-forked worker only one
+    # of the servers is running and the others never return
+    def request_shutdown(signum, frame):
+        for server in servers:
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def request_restart(signum, frame):
+        threading.Thread(target=restart, daemon=True).start()
+
+    def restart():
+        # The successor takes over the listening sockets; this
+        # process drains only once it is serving
+        if spawn_successor([server.socket for server in servers]):
+            request_shutdown(None, None)
+
+    # Reload hooks are shared, so the first server runs them once
+    signal.signal(signal.SIGHUP, lambda signum, frame: servers[0].reload())
+    signal.signal(signal.SIGUSR2, request_restart)
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    # The first listener runs on the main thread, any others
+    # on threads of their own
+    threads = [
+        threading.Thread(target=server.serve_forever)
+        for server in servers[1:]
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+
+        notify_ready()
+        servers[0].serve_forever()
+        for thread in threads:
+            thread.join()
+
+    finally:
+        for server in servers:
+            server.server_close()
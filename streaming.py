@@ -0,0 +1,73 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+LAST_CHUNK = b"0\r\n\r\n"
+
+# Response whose body is produced while it is sent. chunks is an
+# iterable or async iterable of bytes; nothing is pulled from it
+# until the head is on the wire, and each chunk is written before
+# the next one is asked for, so memory stays at one chunk
+class StreamingResponse:
+
+    def __init__(self, chunks, content_type="text/plain; charset=utf-8",
+        code=200, fields=(), content_length=None):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.code = code
+        self.fields = list(fields)
+        # Known lengths are sent as Content-Length and the chunks
+        # go out unframed
+        self.content_length = content_length
+        # Set by HttpResponder: use Transfer-Encoding: chunked
+        self.chunked = False
+
+    def frame(self, chunk):
+        if not self.chunked:
+            return chunk
+
+        return b"%x\r\n%s\r\n" % (len(chunk), chunk)
+
+    def close(self):
+        # Lets a generator run its cleanup when it is never consumed
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            close()
+
+def iterate_sync(chunks):
+    if not hasattr(chunks, "__aiter__"):
+        yield from chunks
+        return
+
+    # Blocking engines drive async generators on a private loop
+    loop = asyncio.new_event_loop()
+    iterator = chunks.__aiter__()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(iterator.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.close()
+
+async def iterate_async(chunks):
+    if hasattr(chunks, "__aiter__"):
+        async for chunk in chunks:
+            yield chunk
+
+    else:
+        for chunk in chunks:
+            yield chunk
@@ -0,0 +1,43 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A self-signed certificate for local testing:
+#
+#   openssl req -x509 -newkey rsa:2048 -nodes -days 30 -subj /CN=localhost \
+#       -keyout key.pem -out cert.pem
+
+import ssl
+
+# Forward secret AEAD suites only; RFC 7540 section 9.2 requires
+# them for HTTP/2 over TLS 1.2, TLS 1.3 suites are always AEAD
+TLS12_CIPHERS = "ECDHE+AESGCM:ECDHE+CHACHA20"
+
+def make_tls_context(cert_file, key_file, http2=False, tickets=2):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS12_CIPHERS)
+    context.load_cert_chain(cert_file, key_file)
+
+    # Resumption skips the certificate exchange and key agreement
+    # on reconnect. TLS 1.2 clients get a stateless ticket unless
+    # OP_NO_TICKET is set; TLS 1.3 clients get num_tickets of them
+    # after the handshake. Ticket keys live in this context, so
+    # forked workers created after it accept each other's tickets
+    context.options &= ~ssl.OP_NO_TICKET
+    context.num_tickets = tickets
+
+    # Clients that offer ALPN are told which protocol to speak;
+    # h2 is only offered when the engine can serve it
+    context.set_alpn_protocols(["h2", "http/1.1"] if http2 else ["http/1.1"])
+    return context
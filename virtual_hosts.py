@@ -0,0 +1,78 @@
+# Copyright 2021 Olivier Vadiavaloo
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+class VirtualHost:
+    __slots__ = ("name", "root", "file_cache", "path_index")
+
+    def __init__(self, name, root, file_cache=None, path_index=None):
+        self.name = name
+        self.root = root
+        # Each site caches and indexes its own files, so one busy
+        # site cannot evict another's bodies
+        self.file_cache = file_cache
+        self.path_index = path_index
+
+# Host header -> VirtualHost. Exact names are one dict hit; a
+# wildcard like "*.example.com" is stored under "example.com"
+# and found by dropping leading labels, so a lookup costs at
+# most one dict hit per label of the requested name
+class VirtualHosts:
+
+    def __init__(self, default):
+        # Serves requests whose Host matches no site
+        self.default = default
+        self.exact = {}
+        self.wildcards = {}
+
+    def add(self, vhost):
+        name = vhost.name.lower()
+        if name.startswith("*."):
+            self.wildcards[name[2:]] = vhost
+        else:
+            self.exact[name] = vhost
+
+    def lookup(self, host):
+        if not host:
+            return self.default
+
+        name = self.strip_port(host.strip().lower())
+        vhost = self.exact.get(name)
+        if vhost is not None:
+            return vhost
+
+        # "a.b.example.com" tries "b.example.com", "example.com"
+        # and "com", so the most specific wildcard wins
+        _, dot, rest = name.partition(".")
+        while dot:
+            vhost = self.wildcards.get(rest)
+            if vhost is not None:
+                return vhost
+            _, dot, rest = rest.partition(".")
+
+        return self.default
+
+    def strip_port(self, host):
+        if host.startswith("["):
+            # "[::1]:8080" -> "[::1]"
+            return host[:host.find("]") + 1]
+
+        return host.partition(":")[0]
+
+    def __iter__(self):
+        # Every site once, even when it is also the default
+        seen = set()
+        for vhost in (self.default, *self.exact.values(), *self.wildcards.values()):
+            if id(vhost) not in seen:
+                seen.add(id(vhost))
+                yield vhost